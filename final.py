@@ -2,20 +2,29 @@ import tkinter as tk
 from tkinter import font, ttk
 import time
 import threading
+import queue
 import random
 from tkinter import messagebox
 import numpy as np
-import tensorflow as tf
-from collections import deque
+from collections import deque, OrderedDict
+from concurrent.futures import Future
 import json
 import os
-
-tf.compat.v1.enable_eager_execution()
-tf.config.run_functions_eagerly(True)  # Ensure eager execution for debugging
-tf.data.experimental.enable_debug_mode()  # Enable debug mode for tf.data functions
+import argparse
+import io
+import zipfile
+import mmap
+import struct
+import hashlib
+import array
+import sys
+import math
+import tempfile
+import asyncio
+import re
 
 class MainPage(tk.Tk):
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, debug=False, corpus_path=None, user=None, **kwargs):
         super().__init__(*args, **kwargs)
         self.title("Typing Master")
         self.geometry("750x615")
@@ -40,24 +49,68 @@ class MainPage(tk.Tk):
         self.style.map("TButton",
                        background=[("active", self.accent_color)],
                        foreground=[("active", self.primary_color)])  # Black text on hover
+        self.style.configure("Custom.TLabelframe", background="#ffffff")
+        self.style.configure("Custom.TLabelframe.Label", foreground="#000000", font=("Helvetica", 12, "bold"))
         
         self.titlefont = font.Font(family="Helvetica", size=24, weight="bold")
         self.subtitlefont = font.Font(family="Helvetica", size=16)
         
-        container = ttk.Frame(self, style="TFrame")
-        container.pack(fill="both", expand=True)
+        self.container = ttk.Frame(self, style="TFrame")
+        self.container.pack(fill="both", expand=True)
         
+        # Session history and difficulty model shared by every page
+        if user is None:
+            self.session_store = SessionStore('typing_sessions.jsonl', 'typing_stats_index.json',
+                                              legacy_path='typing_stats.json')
+        else:
+            os.makedirs(TypingServer.DATA_DIR, exist_ok=True)
+            base = os.path.join(TypingServer.DATA_DIR, user)
+            self.session_store = SessionStore(base + ".jsonl", base + ".index.json")
+        self.model_service = ModelService('typing_model.keras', self.session_store, debug=debug,
+                                          max_batch=1)  # One user: never hold a prediction back
+        if user is not None:
+            # Personal profile on a shared machine: fine-tune a copy of the shared model
+            registry = ModelRegistry(self.model_service, os.path.join(TypingServer.DATA_DIR, "models"))
+            self.model_service = UserModelService(registry, user)
+        self.error_profile = ErrorProfile.load(ErrorProfile.path_for(self.session_store))
+        self.analytics = SessionAnalytics(self.session_store)
+        threading.Thread(target=self.analytics.refresh, daemon=True).start()
+        
+        # Pages announce changes here instead of re-reading each other's files
+        self.events = EventBus()
+        self.events.subscribe("session_completed", self.analytics.add)
+        self.corpus = CorpusIndex(TypeSpeedGUI.TEXT_SAMPLES, external=self.load_corpus(corpus_path))
+        threading.Thread(target=self.corpus.load_variants, args=(VariantGenerator(seed=0),), daemon=True).start()
+        
+        # Pages are built the first time they are shown, then kept for the rest of the run
+        self.pages = {F.__name__: F for F in (WelcomePage, TypingTestPageShort, TypingTestPageMedium,
+                                              TypingTestPageLong, StatsPage)}
         self.frames = {}
-        for F in (WelcomePage, TypingTestPageShort, TypingTestPageMedium, TypingTestPageLong, StatsPage):
-            page_name = F.__name__
-            frame = F(parent=container, controller=self)
-            self.frames[page_name] = frame
-            frame.grid(row=0, column=0, sticky="nsew")
         
         self.show_frame("WelcomePage")
+        self.protocol("WM_DELETE_WINDOW", self.on_close)
+    
+    @staticmethod
+    def load_corpus(corpus_path):
+        """Open an external passage corpus, or None to use the built-in texts"""
+        if not corpus_path or not os.path.exists(corpus_path):
+            return None
+        try:
+            return ExternalCorpus(corpus_path)
+        except Exception as e:
+            print(f"Error loading corpus {corpus_path}: {e}")
+            return None
+    
+    def on_close(self):
+        # Flush pending model updates before the window goes away
+        self.model_service.shutdown()
+        self.destroy()
     
     def show_frame(self, page_name):
-        frame = self.frames[page_name]
+        frame = self.frames.get(page_name)
+        if frame is None:
+            frame = self.frames[page_name] = self.pages[page_name](parent=self.container, controller=self)
+            frame.grid(row=0, column=0, sticky="nsew")
         frame.tkraise()
 
 class WelcomePage(ttk.Frame):
@@ -173,102 +226,2454 @@ class TypingTestPageLong(TypingTestBase):
     def __init__(self, parent, controller):
         super().__init__(parent, controller, "long")
 
-class StatsPage(ttk.Frame):
-    def __init__(self, parent, controller):
-        super().__init__(parent)
-        self.controller = controller
-        self.configure(style="TFrame")
-        
-        # Header
-        header_frame = ttk.Frame(self, style="TFrame")
-        header_frame.pack(pady=10)  # Reduced padding
-        
-        tk.Label(header_frame, 
-                text="Your Performance Stats", 
-                font=controller.titlefont,
-                foreground=controller.primary_color,
-                background=controller.bg_color,
-                justify="center").pack(anchor="center")
-        
-        # Stats display
-        self.stats_text = tk.Text(self, height=8, width=50, wrap=tk.WORD,  # Reduced height and width
-                                font=("Helvetica", 12),
-                                background=controller.bg_color,
-                                foreground=controller.primary_color)
-        self.stats_text.pack(pady=10, padx=10)  # Reduced padding
-        self.stats_text.config(state=tk.DISABLED)
-        
-        self.update_stats()
-        
-        # Buttons
-        button_frame = ttk.Frame(self, style="TFrame")
-        button_frame.pack(pady=5)  # Reduced padding
-        
-        back_button = ttk.Button(button_frame, 
-                               text="Back to Welcome Page", 
-                               command=lambda: controller.show_frame("WelcomePage"))
-        back_button.pack(side="left", padx=5)
+class StatsPage(ttk.Frame):
+    def __init__(self, parent, controller):
+        super().__init__(parent)
+        self.controller = controller
+        self.configure(style="TFrame")
+        
+        # Header
+        header_frame = ttk.Frame(self, style="TFrame")
+        header_frame.pack(pady=10)  # Reduced padding
+        
+        tk.Label(header_frame, 
+                text="Your Performance Stats", 
+                font=controller.titlefont,
+                foreground=controller.primary_color,
+                background=controller.bg_color,
+                justify="center").pack(anchor="center")
+        
+        # Stats display
+        self.stats_text = tk.Text(self, height=8, width=50, wrap=tk.WORD,  # Reduced height and width
+                                font=("Helvetica", 12),
+                                background=controller.bg_color,
+                                foreground=controller.primary_color)
+        self.stats_text.pack(pady=10, padx=10)  # Reduced padding
+        self.stats_text.config(state=tk.DISABLED)
+        
+        self.sections = {}  # Section name -> text currently shown
+        self.update_stats()
+        if not controller.analytics.ready:
+            self.wait_for_analytics()
+        controller.events.subscribe("session_completed", self.on_session_completed)
+        
+        # Buttons
+        button_frame = ttk.Frame(self, style="TFrame")
+        button_frame.pack(pady=5)  # Reduced padding
+        
+        back_button = ttk.Button(button_frame, 
+                               text="Back to Welcome Page", 
+                               command=lambda: controller.show_frame("WelcomePage"))
+        back_button.pack(side="left", padx=5)
+        
+        reset_button = ttk.Button(button_frame,
+                                text="Reset Stats",
+                                command=self.reset_stats)
+        reset_button.pack(side="left", padx=5)
+    
+    SECTIONS = ("summary", "weaknesses", "trends", "recent")
+    
+    def on_session_completed(self, **event):
+        # The store, error profile and analytics are already up to date in memory
+        self.update_stats()
+    
+    def wait_for_analytics(self):
+        """Poll until the first read of the history finishes, then draw the trends"""
+        if self.controller.analytics.ready:
+            self.update_stats()
+        else:
+            self.after(100, self.wait_for_analytics)
+    
+    def update_stats(self):
+        """Redraw the sections whose text has changed"""
+        self.stats_text.config(state=tk.NORMAL)
+        for name, text in self.section_texts().items():
+            if self.sections.get(name) != text:
+                self.draw_section(name, text)
+        self.stats_text.config(state=tk.DISABLED)
+    
+    def draw_section(self, name, text):
+        """Replace the text tagged with a section's name"""
+        ranges = self.stats_text.tag_ranges(name)
+        if ranges:
+            index = ranges[0]
+            self.stats_text.delete(ranges[0], ranges[-1])
+        else:
+            # An empty section has no tagged text; it goes in front of the next one that has
+            later = (self.stats_text.tag_ranges(section) for section in self.SECTIONS[self.SECTIONS.index(name) + 1:])
+            index = next((later_ranges[0] for later_ranges in later if later_ranges), tk.END)
+        if text:
+            self.stats_text.insert(index, text, name)
+        self.sections[name] = text
+    
+    def section_texts(self):
+        """Text of every section, built from in-memory aggregates only"""
+        store = self.controller.session_store
+        summary = store.index.summary()
+        
+        # Averages come straight from the running aggregates
+        total_sessions = summary['count']
+        if total_sessions == 0:
+            return {"summary": "No data available yet. Complete some typing tests first!",
+                    "weaknesses": "", "trends": "", "recent": ""}
+        avg_wpm = summary['wpm'][0]
+        avg_accuracy = summary['accuracy'][0]
+        avg_reaction = summary['avg_reaction_time'][0]
+        
+        text = (f"Total Sessions: {total_sessions}\n"
+                f"Average WPM: {avg_wpm:.2f}\n"
+                f"Average Accuracy: {avg_accuracy:.2f}%\n"
+                f"Average Reaction Time: {avg_reaction:.2f} sec\n\n")
+        
+        # AI recommendations
+        if avg_wpm < 30:
+            text += "AI Suggestion: Focus on accuracy first, then gradually increase speed.\n"
+        elif avg_wpm < 50:
+            text += "AI Suggestion: Practice with medium-length texts to build consistency.\n"
+        else:
+            text += "AI Suggestion: Challenge yourself with long texts and complex vocabulary.\n"
+        
+        if avg_accuracy < 90:
+            text += "AI Suggestion: Slow down to improve accuracy. Speed will come naturally.\n"
+        sections = {"summary": text}
+        
+        # Keys and key pairs that go wrong most often
+        text = ""
+        weak_keys = self.controller.error_profile.weak_keys()
+        if weak_keys:
+            text += "Weak keys: " + ", ".join(f"'{char}' {rate:.0%} errors" for char, rate, _ in weak_keys) + "\n"
+        weak_bigrams = self.controller.error_profile.weak_bigrams()
+        if weak_bigrams:
+            text += "Weak key pairs: " + ", ".join(f"'{pair}' {rate:.0%}" for pair, rate, _ in weak_bigrams) + "\n"
+        sections["weaknesses"] = text
+        
+        # Trends over the full history, if it has been loaded; a refresh
+        # only reads the log when sessions arrived without an event
+        analytics = self.controller.analytics
+        if analytics.ready and analytics.refresh(wait=False):
+            sections["trends"] = self.trends_text(analytics)
+        else:
+            sections["trends"] = self.sections.get("trends", "")
+        
+        # Recent sessions
+        sections["recent"] = "\nRecent Sessions:\n" + "".join(
+            f"{session['date']}: {session['wpm']:.1f} WPM, {session['accuracy']:.1f}% accuracy\n"
+            for session in list(store.recent)[-5:])
+        return sections
+    
+    def trends_text(self, analytics):
+        """Trend, spread and per-type lines computed from the whole history"""
+        text = "\nTrends:\n"
+        text += f"WPM change per session (last 20): {analytics.trend('wpm'):+.2f}\n"
+        text += f"Accuracy change per session (last 20): {analytics.trend('accuracy'):+.2f}%\n"
+        rolling = analytics.rolling_mean('wpm', 10)
+        if len(rolling):
+            text += f"Best 10-session average: {rolling.max():.1f} WPM\n"
+        low, median, high = analytics.percentiles('wpm')
+        text += f"WPM 10th-90th percentile: {low:.1f} - {high:.1f} (median {median:.1f})\n"
+        
+        counts, means = analytics.breakdown('wpm')
+        for text_type, type_counts, type_means in zip(analytics.TEXT_TYPES, counts, means):
+            total = type_counts.sum()
+            if total:
+                mean = (type_counts @ np.nan_to_num(type_means)) / total
+                text += f"{text_type.capitalize()} texts: {mean:.1f} WPM over {total} sessions\n"
+        return text
+
+    def reset_stats(self):
+        """Reset the stats by clearing the session log."""
+        try:
+            self.controller.session_store.reset()
+            self.controller.error_profile = ErrorProfile()
+            self.controller.error_profile.save(ErrorProfile.path_for(self.controller.session_store))
+            messagebox.showinfo("Reset Stats", "All stats have been reset successfully!")
+            self.update_stats()
+        except Exception as e:
+            messagebox.showerror("Error", f"Failed to reset stats: {e}")
+
+def write_atomically(path, text):
+    """Write text to path via a temp file and rename, so readers never see a partial file"""
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'w') as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+
+class StatsIndex:
+    """Running per-group aggregates of the session log, saved with the log size they cover"""
+    FIELDS = ('wpm', 'accuracy', 'avg_reaction_time')
+    VERSION = 1
+
+    def __init__(self):
+        self.groups = {}        # "text_type/difficulty" -> {'count': n, field: [sum, sumsq, min, max]}
+        self.count = 0
+        self.log_size = 0       # Bytes of the log this index accounts for
+        self.dead_records = 0   # Log lines a compaction would drop
+        self.user_level = 1
+    
+    @classmethod
+    def from_sessions(cls, sessions):
+        index = cls()
+        for session in sessions:
+            index.add(session)
+        return index
+    
+    def add(self, session):
+        key = f"{session['text_type']}/{session['difficulty']}"
+        group = self.groups.get(key)
+        if group is None:
+            group = self.groups[key] = {'count': 0}
+            for field in self.FIELDS:
+                group[field] = [0.0, 0.0, float('inf'), float('-inf')]
+        
+        group['count'] += 1
+        for field in self.FIELDS:
+            value = float(session[field])
+            agg = group[field]
+            agg[0] += value
+            agg[1] += value * value
+            agg[2] = min(agg[2], value)
+            agg[3] = max(agg[3], value)
+        self.count += 1
+    
+    def clear(self):
+        self.groups = {}
+        self.count = 0
+    
+    def summary(self, text_type=None, difficulty=None):
+        """Combine matching groups into {field: (mean, std, min, max)} plus the session count"""
+        count = 0
+        totals = {field: [0.0, 0.0, float('inf'), float('-inf')] for field in self.FIELDS}
+        for key, group in self.groups.items():
+            group_type, group_difficulty = key.split('/')
+            if text_type is not None and group_type != text_type:
+                continue
+            if difficulty is not None and int(group_difficulty) != difficulty:
+                continue
+            count += group['count']
+            for field in self.FIELDS:
+                total, agg = totals[field], group[field]
+                total[0] += agg[0]
+                total[1] += agg[1]
+                total[2] = min(total[2], agg[2])
+                total[3] = max(total[3], agg[3])
+        
+        summary = {'count': count}
+        for field, (total, total_sq, low, high) in totals.items():
+            if count:
+                mean = total / count
+                std = max(0.0, total_sq / count - mean * mean) ** 0.5
+                summary[field] = (mean, std, low, high)
+            else:
+                summary[field] = (0.0, 0.0, 0.0, 0.0)
+        return summary
+    
+    def to_dict(self):
+        return {
+            'version': self.VERSION,
+            'count': self.count,
+            'log_size': self.log_size,
+            'dead_records': self.dead_records,
+            'user_level': self.user_level,
+            'groups': self.groups
+        }
+    
+    @classmethod
+    def load(cls, path):
+        """Read a saved index, or return None if it is missing or from another version"""
+        try:
+            with open(path, 'r') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if data.get('version') != cls.VERSION:
+            return None
+        
+        index = cls()
+        index.count = data['count']
+        index.log_size = data['log_size']
+        index.dead_records = data['dead_records']
+        index.user_level = data['user_level']
+        index.groups = data['groups']
+        return index
+    
+    def save(self, path):
+        write_atomically(path, json.dumps(self.to_dict()))
+
+class ExternalCorpus:
+    """Large passage file read lazily through mmap, with a cached offset index in <corpus>.idx"""
+    INDEX_MAGIC = b"TTCI"
+    INDEX_VERSION = 2
+    HEADER = struct.Struct("<4sIQQII32s")  # magic, version, corpus size, corpus mtime, passages, buckets, digest
+    TEXT_TYPES = ("short", "medium", "long")
+    LENGTH_LIMITS = (120, 400, 1000)    # Max bytes of a short, medium and long passage
+
+    def __init__(self, path):
+        self.path = path
+        self.index_path = f"{path}.idx"
+        with open(path, 'rb') as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        stat = os.stat(path)
+        self.source_key = (stat.st_size, stat.st_mtime_ns)
+        
+        if not self.open_index():
+            self.build_index()
+            if not self.open_index():
+                raise ValueError(f"Could not index {path}")
+    
+    def open_index(self):
+        """Map the cached index; returns False if it is missing or out of date"""
+        try:
+            with open(self.index_path, 'rb') as f:
+                index = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return False
+        
+        if len(index) < self.HEADER.size:
+            return False
+        magic, version, size, mtime, count, bucket_count, digest = self.HEADER.unpack_from(index)
+        if (magic, version, (size, mtime)) != (self.INDEX_MAGIC, self.INDEX_VERSION, self.source_key):
+            return False
+        self.digest = digest
+        
+        view = memoryview(index)
+        offset = self.HEADER.size
+        table = view[offset:offset + 8 * 2 * bucket_count].cast('Q')
+        offset += 8 * 2 * bucket_count
+        self.starts = view[offset:offset + 8 * count].cast('Q')
+        offset += 8 * count
+        self.ends = view[offset:offset + 8 * count].cast('Q')
+        
+        self.index = index
+        self.buckets = {}
+        for b in range(bucket_count):
+            key = (self.TEXT_TYPES[b // 5], b % 5 + 1)
+            if table[2 * b + 1] > table[2 * b]:
+                self.buckets[key] = (table[2 * b], table[2 * b + 1])
+        return True
+    
+    def build_index(self):
+        """Scan the corpus once, classifying every passage by length and difficulty"""
+        rows = [[] for _ in range(len(self.TEXT_TYPES) * 5)]
+        data = self.data
+        position = 0
+        while position < len(data):
+            end = data.find(b"\n", position)
+            if end == -1:
+                end = len(data)
+            line_end = end - 1 if end > position and data[end - 1] == 13 else end  # Strip \r
+            level = None
+            if line_end - position > 2 and data[position + 1] == 9 and 49 <= data[position] <= 53:
+                level = data[position] - 48  # Explicit "1\t" to "5\t" prefix
+                position += 2
+            text_type = self.classify(line_end - position)
+            if text_type is not None:
+                text = data[position:line_end].decode('utf-8', errors='replace').strip()
+                if text:
+                    level = level or CorpusIndex.text_difficulty(text)
+                    rows[self.TEXT_TYPES.index(text_type) * 5 + level - 1].append((position, line_end))
+            position = end + 1
+        
+        table = []
+        starts = []
+        ends = []
+        for bucket_rows in rows:
+            table.extend((len(starts), len(starts) + len(bucket_rows)))
+            for start, end in bucket_rows:
+                starts.append(start)
+                ends.append(end)
+        
+        digest = hashlib.sha256(self.data).digest()
+        header = self.HEADER.pack(self.INDEX_MAGIC, self.INDEX_VERSION, *self.source_key,
+                                  len(starts), len(rows), digest)
+        body = struct.pack(f"<{len(table)}Q", *table) + struct.pack(f"<{len(starts)}Q", *starts) \
+            + struct.pack(f"<{len(ends)}Q", *ends)
+        temp_path = f"{self.index_path}.tmp"
+        with open(temp_path, 'wb') as f:
+            f.write(header + body)
+        os.replace(temp_path, self.index_path)
+    
+    def classify(self, length):
+        for text_type, limit in zip(self.TEXT_TYPES, self.LENGTH_LIMITS):
+            if 0 < length <= limit:
+                return text_type
+        return None  # Empty, or too long to fit on screen
+    
+    def __len__(self):
+        return len(self.starts)
+    
+    def passage(self, row):
+        return self.data[self.starts[row]:self.ends[row]].decode('utf-8', errors='replace').strip()
+    
+    def bucket(self, text_type, difficulty):
+        """Lazy sequence view of the passages in one bucket, or None if it is empty"""
+        span = self.buckets.get((text_type, difficulty))
+        return PassageBucket(self, *span) if span else None
+    
+    def has_text_type(self, text_type):
+        return any(key[0] == text_type for key in self.buckets)
+    
+    def passages(self):
+        return (self.passage(row) for row in range(len(self)))
+
+class PassageBucket:
+    """Sequence view over a contiguous range of an ExternalCorpus index"""
+    def __init__(self, corpus, start, end):
+        self.corpus = corpus
+        self.start = start
+        self.end = end
+    
+    def __len__(self):
+        return self.end - self.start
+    
+    def __getitem__(self, i):
+        return self.corpus.passage(self.start + i)
+
+class ChainedBucket:
+    """Sequence view over several buckets one after the other"""
+    def __init__(self, parts):
+        self.parts = parts
+    
+    def __len__(self):
+        return sum(len(part) for part in self.parts)
+    
+    def __getitem__(self, i):
+        for part in self.parts:
+            if i < len(part):
+                return part[i]
+            i -= len(part)
+        raise IndexError(i)
+
+class VariantGenerator:
+    """Builds deterministic difficulty variants of a corpus, once per corpus.
+    
+    The output file name carries the source digest, variant version and seed,
+    so a corpus is only ever transformed once.
+    """
+    VERSION = 1
+    CHUNK_SIZE = 10000  # Passages transformed per batch of random draws
+    COMPLEX_WORDS = [
+        "algorithm", "binary", "compiler", "debugging", "encapsulation",
+        "framework", "inheritance", "javascript", "kernel", "lambda",
+        "multithreading", "namespace", "object", "polymorphism", "query",
+        "recursion", "syntax", "template", "utility", "variable"
+    ]
+
+    def __init__(self, seed=0):
+        self.seed = seed
+    
+    def variants_path(self, digest, directory="."):
+        key = hashlib.sha256(digest + f"|v{self.VERSION}|s{self.seed}".encode()).hexdigest()[:16]
+        return os.path.join(directory, f"typing_variants-{key}.txt")
+    
+    def open_or_build(self, texts, digest, directory="."):
+        """Open the cached variants of a corpus, generating them first if needed"""
+        path = self.variants_path(digest, directory)
+        if not os.path.exists(path):
+            temp_path = f"{path}.tmp"
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                for base, variants in self.generate(texts):
+                    for level, text in enumerate(variants, start=1):
+                        if text != base:
+                            f.write(f"{level}\t{text}\n")
+            os.replace(temp_path, path)
+        if os.path.getsize(path) == 0:
+            return None
+        return ExternalCorpus(path)
+    
+    def generate(self, texts):
+        """Yield (text, [level 1..5 variants]) for every text"""
+        rng = np.random.default_rng(self.seed)
+        complex_words = np.array(self.COMPLEX_WORDS, dtype=object)
+        chunk = []
+        for text in texts:
+            chunk.append(text)
+            if len(chunk) == self.CHUNK_SIZE:
+                yield from self.generate_chunk(chunk, rng, complex_words)
+                chunk = []
+        if chunk:
+            yield from self.generate_chunk(chunk, rng, complex_words)
+    
+    def generate_chunk(self, texts, rng, complex_words):
+        split = [text.split() for text in texts]
+        words = np.array([word for text_words in split for word in text_words], dtype=object)
+        is_short = np.fromiter(map(len, words), dtype=np.int64, count=len(words)) < 5
+        bounds = np.cumsum([len(text_words) for text_words in split])[:-1]
+        
+        variants = [[text, text, text] for text in texts]  # Levels 1-3 are unchanged
+        for level in (4, 5):
+            # For higher difficulties, sometimes replace short words with longer ones
+            replace = is_short & (rng.random(len(words)) > 0.7)
+            picks = complex_words[rng.integers(len(complex_words), size=len(words))]
+            modified = np.where(replace, picks, words)
+            for text_variants, text_words in zip(variants, np.split(modified, bounds)):
+                text = " ".join(text_words)
+                text_variants.append(self.complicate(text) if level == 5 else text)
+        return zip(texts, variants)
+    
+    @staticmethod
+    def complicate(text):
+        """For highest difficulty, make sentences more complex"""
+        if not any(p in text for p in [",", ";", ":"]):
+            parts = text.split(". ")
+            if len(parts) > 1:
+                text = ", ".join(parts[:-1]) + "; " + parts[-1]
+        return text
+
+class NgramIndex:
+    """Inverted index from character bigrams and trigrams to the passages of one bucket"""
+    SIZE = 96           # ErrorProfile.SIZE
+    TRIGRAM_BASE = SIZE * SIZE
+    FEATURES = TRIGRAM_BASE + SIZE ** 3
+    QUERY_BIGRAMS = 64  # Weakest bigrams in a query
+    PRIOR = 5           # Attempts added to every bigram so rare ones don't dominate
+    CHUNK_SIZE = 2048   # Passages decoded and indexed at a time; positions in a chunk must fit in 16 bits
+    # Byte -> ErrorProfile slot; bytes of multi-byte characters fall into the catch-all slot
+    SLOTS = np.full(256, SIZE - 1, dtype=np.int32)
+    SLOTS[32:127] = np.arange(SIZE - 1)
+    
+    def __init__(self, passages, chunk_size=CHUNK_SIZE):
+        count = len(passages)
+        chunks = []
+        totals = np.zeros(self.FEATURES, dtype=np.int64)
+        for first in range(0, count, chunk_size):
+            chunk = self.index_chunk([passages[i].encode('utf-8') for i in range(first, min(first + chunk_size, count))])
+            chunk.append(first)
+            totals += np.bincount(chunk[1], minlength=self.FEATURES)
+            chunks.append(chunk)
+        self.lengths = np.concatenate([chunk[0] for chunk in chunks]) if chunks else np.zeros(0, dtype=np.int32)
+        
+        # Counting sort into one posting list per feature, passages in order within each
+        self.starts = np.zeros(self.FEATURES + 1, dtype=np.int64)
+        np.cumsum(totals, out=self.starts[1:])
+        self.postings = np.empty(self.starts[-1], dtype=np.int32)
+        self.counts = np.empty(self.starts[-1], dtype=np.uint16)
+        cursor = self.starts[:-1].copy()
+        while chunks:
+            _, features, owners, counts, first = chunks.pop(0)
+            rank = np.arange(len(features)) - np.searchsorted(features, features)  # Features are sorted
+            positions = cursor[features] + rank
+            self.postings[positions] = owners.astype(np.int32) + first
+            self.counts[positions] = counts
+            cursor += np.bincount(features, minlength=self.FEATURES)
+    
+    @classmethod
+    def index_chunk(cls, texts):
+        """Lengths, and the (feature, passage, count) triples of a few encoded passages sorted by feature"""
+        count = len(texts)
+        lengths = np.fromiter(map(len, texts), dtype=np.int32, count=count)
+        slots = cls.SLOTS[np.frombuffer(b"".join(texts), dtype=np.uint8)]
+        owner = np.repeat(np.arange(count, dtype=np.int32), lengths)
+        
+        pair = owner[:-1] == owner[1:]
+        triple = pair[:-1] & pair[1:]
+        bigrams = slots[:-1] * cls.SIZE + slots[1:]
+        trigrams = cls.TRIGRAM_BASE + bigrams[:-1] * cls.SIZE + slots[2:]
+        features = np.concatenate((bigrams[pair], trigrams[triple])).astype(np.int64)
+        owners = np.concatenate((owner[:-1][pair], owner[:-2][triple]))
+        
+        keys, counts = np.unique(features * count + owners, return_counts=True)
+        return [lengths, (keys // count).astype(np.int32), (keys % count).astype(np.uint16),
+                np.minimum(counts, np.iinfo(np.uint16).max).astype(np.uint16)]
+    
+    def __len__(self):
+        return len(self.lengths)
+    
+    @classmethod
+    def query(cls, profile):
+        """Sparse {feature: weight} vector of the n-grams a user gets wrong"""
+        attempts = profile.bigram_attempts.ravel()
+        errors = profile.bigram_errors.ravel()
+        rates = errors / (attempts + cls.PRIOR)
+        weak = np.flatnonzero(errors)
+        weak = weak[np.argsort(-rates[weak], kind='stable')[:cls.QUERY_BIGRAMS]]
+        weights = {int(feature): float(rates[feature]) for feature in weak}
+        
+        # A trigram is as hard as both of the transitions in it
+        by_first = {}
+        for feature, weight in weights.items():
+            by_first.setdefault(feature // cls.SIZE, []).append((feature % cls.SIZE, weight))
+        trigrams = {}
+        for feature, weight in weights.items():
+            first, middle = divmod(feature, cls.SIZE)
+            for last, next_weight in by_first.get(middle, ()):
+                trigrams[cls.TRIGRAM_BASE + feature * cls.SIZE + last] = weight * next_weight
+        weights.update(trigrams)
+        return weights
+    
+    def top(self, query, k=10, exclude=()):
+        """Positions of the k passages with the highest weighted n-gram density, best first, skipping exclude"""
+        scores = np.zeros(len(self), dtype=np.float32)
+        for feature, weight in query.items():
+            start, end = self.starts[feature], self.starts[feature + 1]
+            scores[self.postings[start:end]] += weight * self.counts[start:end]
+        scores /= np.maximum(self.lengths, 1)
+        exclude = np.asarray(exclude, dtype=np.int64)
+        scores[exclude[exclude < len(scores)]] = 0  # The index may not cover variants added since
+        
+        k = min(k, len(scores))
+        if k == 0:
+            return []
+        best = np.argpartition(-scores, k - 1)[:k]
+        best = best[np.argsort(-scores[best], kind='stable')]
+        return [int(position) for position in best if scores[position] > 0]
+
+class CorpusIndex:
+    """Sample texts bucketed by text type and difficulty, built once"""
+    DECK_LIMIT = 4096  # Largest bucket dealt from a shuffled deck
+    RECOMMEND_K = 10   # Best-matching passages a targeted pick is drawn from
+
+    def __init__(self, corpus, external=None, rng=None):
+        self.rng = rng or random.Random()
+        self.external = external
+        self.builtin_variants = None
+        self.external_variants = None
+        self.buckets = {}  # (text_type, difficulty) -> list of texts
+        self.decks = {}    # (text_type, difficulty) -> (bucket size, positions still to serve this round)
+        self.last_served = {}
+        self.recent = {}   # (text_type, difficulty) -> (deque, set) of recent positions in large buckets
+        self.ngram_indexes = {}  # (text_type, difficulty) -> NgramIndex of the bucket, built on first use
+        self.ngram_building = set()
+        self.lock = threading.Lock()
+        self.builtin_texts = [text for texts in corpus.values() for text in texts]
+        for text_type, texts in corpus.items():
+            for text in texts:
+                key = (text_type, self.text_difficulty(text))
+                self.buckets.setdefault(key, []).append(text)
+    
+    @staticmethod
+    def text_difficulty(text):
+        """Simple heuristic to match text to difficulty level"""
+        words = text.split()
+        avg_word_len = sum(len(word) for word in words) / len(words)
+        complexity = avg_word_len * len([c for c in text if c in ',;:'])
+        return min(5, max(1, int(complexity / 5 + 1)))
+    
+    def load_variants(self, generator):
+        """Generate or open the cached difficulty variants of both sources"""
+        try:
+            digest = hashlib.sha256("\n".join(self.builtin_texts).encode('utf-8')).digest()
+            self.builtin_variants = generator.open_or_build(self.builtin_texts, digest)
+            if self.external is not None:
+                self.external_variants = generator.open_or_build(
+                    self.external.passages(), self.external.digest,
+                    os.path.dirname(os.path.abspath(self.external.path)))
+        except Exception as e:
+            print(f"Error generating text variants: {e}")
+    
+    def get_bucket(self, text_type, difficulty):
+        if self.external is not None and self.external.has_text_type(text_type):
+            sources = (self.external, self.external_variants)
+            parts = []
+        else:
+            sources = (self.builtin_variants,)
+            parts = [self.buckets.get((text_type, difficulty))]
+        parts.extend(source.bucket(text_type, difficulty) for source in sources if source is not None)
+        parts = [part for part in parts if part]
+        if len(parts) > 1:
+            return ChainedBucket(parts)
+        return parts[0] if parts else None
+    
+    def select(self, text_type, difficulty, profile=None):
+        """Pick a text of the given type from the nearest level that has any, favoring profile's weak pairs"""
+        for distance in range(5):
+            for level in (difficulty - distance, difficulty + distance):
+                bucket = self.get_bucket(text_type, level)
+                if bucket:
+                    key = (text_type, level)
+                    position = self.target(key, bucket, profile) if profile is not None else None
+                    if position is None:
+                        position = self.deal(key, len(bucket))
+                    return bucket[position]
+        raise KeyError(f"No texts for {text_type}")
+    
+    def target(self, key, bucket, profile):
+        """Position of a text that drills profile's weak pairs and wasn't served lately, or None"""
+        size = len(bucket)
+        if size > self.DECK_LIMIT:
+            order, seen = self.recent_positions(key)
+            served = np.fromiter(seen, dtype=np.int64, count=len(seen))
+        else:
+            # Targeted picks come out of the same deck as dealt ones, so the best matches take turns
+            served = np.ones(size, dtype=bool)
+            served[self.current_deck(key, size)] = False
+            served = np.flatnonzero(served)
+        candidates = self.recommend(key, bucket, profile, exclude=served)
+        if not candidates:
+            return None
+        
+        position = self.rng.choice(candidates)
+        if size > self.DECK_LIMIT:
+            self.remember_large(key, position)
+        else:
+            self.current_deck(key, size).remove(position)
+        self.last_served[key] = position
+        return position
+    
+    def recommend(self, key, bucket, profile, k=RECOMMEND_K, exclude=()):
+        """Top-k positions in bucket for the weak n-grams in profile, leaving out those in exclude"""
+        query = NgramIndex.query(profile)
+        if not query:
+            return []
+        index = self.ngram_indexes.get(key)
+        if index is None or len(index) != len(bucket):  # Variants may have joined the bucket
+            self.build_ngram_index(key, bucket)
+        # A stale index still covers the start of the bucket, which variants only extend
+        return [] if index is None else index.top(query, k, exclude)
+    
+    def build_ngram_index(self, key, bucket):
+        """Index a bucket on a background thread; select() keeps dealing until it is ready"""
+        with self.lock:
+            if key in self.ngram_building:
+                return
+            self.ngram_building.add(key)
+        
+        def build():
+            try:
+                self.ngram_indexes[key] = NgramIndex(bucket)
+            except Exception as e:
+                print(f"Error indexing {key[0]} texts at level {key[1]}: {e}")
+            finally:
+                with self.lock:
+                    self.ngram_building.discard(key)
+        threading.Thread(target=build, name="ngram-index", daemon=True).start()
+    
+    def deal(self, key, size):
+        """Choose the position of the next text to serve from a bucket of the given size"""
+        if size > self.DECK_LIMIT:
+            return self.sample_large(key, size)
+        
+        position = self.current_deck(key, size).pop()
+        self.last_served[key] = position
+        return position
+    
+    def current_deck(self, key, size):
+        """Positions of a small bucket still to serve this round, reshuffled once all have been"""
+        deck_size, deck = self.decks.get(key, (size, None))
+        if not deck or deck_size != size:
+            deck = list(range(size))
+            self.decks[key] = (size, deck)
+            self.rng.shuffle(deck)
+            # Don't start the new round with the text that ended the last one
+            if size > 1 and deck[-1] == self.last_served.get(key):
+                deck[0], deck[-1] = deck[-1], deck[0]
+        return deck
+    
+    def recent_positions(self, key):
+        if key not in self.recent:
+            self.recent[key] = (deque(), set())
+        return self.recent[key]
+    
+    def remember_large(self, key, position):
+        order, seen = self.recent_positions(key)
+        order.append(position)
+        seen.add(position)
+        if len(order) > self.DECK_LIMIT // 4:
+            seen.discard(order.popleft())
+    
+    def sample_large(self, key, size):
+        order, seen = self.recent_positions(key)
+        position = self.rng.randrange(size)
+        while position in seen:
+            position = self.rng.randrange(size)
+        self.remember_large(key, position)
+        return position
+
+class SessionStore:
+    """Append-only JSON-lines log of typing sessions plus a StatsIndex of running aggregates"""
+    COMPACT_THRESHOLD = 100  # Dead records tolerated before compacting
+    RECENT_LIMIT = 512       # Sessions kept in memory for training and smoothing
+    LOG_VERSION = 1
+
+    def __init__(self, log_path, index_path, legacy_path=None, load=True):
+        self.log_path = log_path
+        self.index_path = index_path
+        self.legacy_path = legacy_path
+        self.lock = threading.Lock()
+        self.index = StatsIndex()
+        self.recent = deque(maxlen=self.RECENT_LIMIT)
+        
+        if not load:
+            return  # Leave the files exactly as they are, e.g. to check them
+        if not os.path.exists(self.log_path) and legacy_path and os.path.exists(legacy_path):
+            self.migrate_legacy_stats()
+        self.load()
+    
+    @property
+    def session_count(self):
+        return self.index.count
+    
+    def log_size(self):
+        try:
+            return os.path.getsize(self.log_path)
+        except OSError:
+            return 0
+    
+    def load(self):
+        """Open the saved index, rebuilding it from the log if it is stale"""
+        index = StatsIndex.load(self.index_path)
+        if index is None or index.log_size != self.log_size():
+            self.rebuild()
+        else:
+            self.index = index
+            self.recent = deque(self.read_tail(), maxlen=self.RECENT_LIMIT)
+        
+        if self.index.dead_records >= self.COMPACT_THRESHOLD:
+            self.compact()
+    
+    def rebuild(self):
+        """Replay the whole log and rebuild the aggregate index from scratch"""
+        sessions, dead_records, user_level = self.read_log()
+        self.index = StatsIndex.from_sessions(sessions)
+        self.index.dead_records = dead_records
+        self.index.user_level = user_level
+        self.index.log_size = self.log_size()
+        self.index.save(self.index_path)
+        self.recent = deque(sessions[-self.RECENT_LIMIT:], maxlen=self.RECENT_LIMIT)
+    
+    def read_log(self, repair=True):
+        """Return the live sessions, the number of dead records and the user level; repair=False never writes"""
+        sessions = []
+        dead_records = 0
+        user_level = self.index.user_level
+        line = "\n"
+        try:
+            with open(self.log_path, 'r') as f:
+                for line in f:
+                    record = self.parse(line)
+                    if record is None:
+                        dead_records += 1  # Torn write or garbage
+                    elif record['event'] == 'session':
+                        sessions.append(record['data'])
+                    elif record['event'] == 'reset':
+                        dead_records += len(sessions) + 1
+                        sessions = []
+                    elif record['event'] == 'meta':
+                        user_level = record.get('user_level', user_level)
+        except FileNotFoundError:
+            return sessions, dead_records, user_level
+        
+        if repair and not line.endswith("\n"):
+            # Terminate a torn last line so the next append starts on a fresh one
+            with open(self.log_path, 'a') as f:
+                f.write("\n")
+        return sessions, dead_records, user_level
+    
+    def read_tail(self, block_size=65536):
+        """Read the newest sessions by scanning the log backwards from the end"""
+        sessions = []
+        try:
+            f = open(self.log_path, 'rb')
+        except FileNotFoundError:
+            return sessions  # Index saved before any session was logged
+        with f:
+            position = f.seek(0, os.SEEK_END)
+            remainder = b""
+            while position > 0 and len(sessions) < self.RECENT_LIMIT:
+                step = min(block_size, position)
+                position -= step
+                f.seek(position)
+                lines = (f.read(step) + remainder).split(b"\n")
+                # The first piece may be a partial line unless we hit the start of the file
+                remainder = lines.pop(0) if position > 0 else b""
+                for line in reversed(lines):
+                    record = self.parse(line)
+                    if record is None:
+                        continue
+                    if record['event'] == 'reset':
+                        return sessions[::-1]
+                    if record['event'] == 'session':
+                        sessions.append(record['data'])
+                        if len(sessions) == self.RECENT_LIMIT:
+                            break
+        return sessions[::-1]
+    
+    @staticmethod
+    def parse(line):
+        try:
+            record = json.loads(line)
+            record['event']
+            return record
+        except (ValueError, KeyError, TypeError):
+            return None
+    
+    def migrate_legacy_stats(self):
+        """One-time import of the old single-document typing_stats.json"""
+        try:
+            with open(self.legacy_path, 'r') as f:
+                legacy = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Error migrating stats: {e}")
+            return
+        
+        sessions = legacy.get('sessions', [])
+        self.index.user_level = legacy.get('user_level', 1)
+        self.write_log(sessions)
+        print(f"Migrated {len(sessions)} sessions from {self.legacy_path}")
+    
+    def append(self, session_data):
+        """Record a finished session"""
+        line = json.dumps({'event': 'session', 'data': session_data}) + "\n"
+        with self.lock:
+            with open(self.log_path, 'a') as f:
+                f.write(line)
+                log_size = f.tell()
+            self.recent.append(session_data)
+            self.index.add(session_data)
+            self.index.log_size = log_size
+            self.index.save(self.index_path)
+    
+    def reset(self):
+        """Forget all sessions"""
+        with self.lock:
+            with open(self.log_path, 'a') as f:
+                f.write(json.dumps({'event': 'reset'}) + "\n")
+                log_size = f.tell()
+            self.index.dead_records += self.index.count + 1
+            self.index.clear()
+            self.index.log_size = log_size
+            self.recent.clear()
+            if self.index.dead_records >= self.COMPACT_THRESHOLD:
+                self.compact()
+            else:
+                self.index.save(self.index_path)
+    
+    def check_index(self):
+        """Compare the saved index with one rebuilt from the log; returns a list of mismatches"""
+        saved = StatsIndex.load(self.index_path)
+        if saved is None:
+            return [f"{self.index_path} is missing or unreadable"]
+        sessions, dead_records, user_level = self.read_log(repair=False)
+        rebuilt = StatsIndex.from_sessions(sessions)
+        
+        mismatches = []
+        for name, saved_value, log_value in (('count', saved.count, rebuilt.count),
+                                             ('log_size', saved.log_size, self.log_size()),
+                                             ('dead_records', saved.dead_records, dead_records),
+                                             ('user_level', saved.user_level, user_level)):
+            if saved_value != log_value:
+                mismatches.append(f"{name}: index has {saved_value}, log has {log_value}")
+        for key in sorted(set(saved.groups) | set(rebuilt.groups)):
+            saved_group, log_group = saved.groups.get(key), rebuilt.groups.get(key)
+            if saved_group is None or log_group is None or saved_group['count'] != log_group['count']:
+                mismatches.append(f"{key}: index has {saved_group and saved_group['count']} sessions, "
+                                  f"log has {log_group and log_group['count']}")
+                continue
+            for field in StatsIndex.FIELDS:
+                if not all(math.isclose(a, b, rel_tol=1e-9, abs_tol=1e-9)
+                           for a, b in zip(saved_group[field], log_group[field])):
+                    mismatches.append(f"{key} {field}: index has {saved_group[field]}, log has {log_group[field]}")
+        return mismatches
+    
+    def compact(self):
+        """Rewrite the log with only the live records, replacing it atomically"""
+        sessions, _, _ = self.read_log()
+        self.write_log(sessions)
+        self.index.dead_records = 0
+        self.index.log_size = self.log_size()
+        self.index.save(self.index_path)
+    
+    def write_log(self, sessions):
+        # The creation stamp tells readers that hold byte offsets the log was rewritten
+        lines = [json.dumps({'event': 'meta', 'version': self.LOG_VERSION, 'user_level': self.index.user_level,
+                             'created': time.time()})]
+        lines.extend(json.dumps({'event': 'session', 'data': session}) for session in sessions)
+        write_atomically(self.log_path, "\n".join(lines) + "\n")
+    
+class SessionAnalytics:
+    """Column-oriented NumPy view of the full session history for the stats page"""
+    DTYPE = np.dtype([('date', 'datetime64[s]'), ('wpm', 'f4'), ('accuracy', 'f4'),
+                      ('reaction', 'f4'), ('difficulty', 'i1'), ('text_type', 'i1')])
+    TEXT_TYPES = ("short", "medium", "long")
+    LEVELS = 5
+    SAVE_EVERY = 10000  # Newly parsed sessions before the column cache is rewritten
+    READ_SIZE = 1 << 22  # Bytes of log parsed at a time
+    
+    def __init__(self, store):
+        self.store = store
+        self.columns = np.empty(0, dtype=self.DTYPE)
+        self.size = 0       # Rows in use; columns may have spare capacity
+        self.offset = 0     # Bytes of the log already parsed
+        self.header = b""   # First line of the log, which changes when it is rewritten
+        self.unsaved = 0
+        self.results = {}
+        self.lock = threading.Lock()
+        self.ready = False  # Set once the history has been read the first time
+        self.cache_path = store.log_path + ".columns.npy"
+        self.cache_meta_path = store.log_path + ".columns.json"
+    
+    def refresh(self, wait=True):
+        """Parse sessions appended since the last call; False if another thread is already at it"""
+        if not self.lock.acquire(blocking=wait):
+            return False
+        try:
+            log_size = self.store.index.log_size
+            if log_size == self.offset:
+                return True
+            header = self.read_header()
+            if header != self.header or log_size < self.offset:
+                self.clear()
+                self.header = header
+                self.load_cache(log_size)
+            if log_size > self.offset:
+                self.read_from(self.offset)
+            if self.unsaved >= self.SAVE_EVERY:
+                self.save_cache()
+            return True
+        finally:
+            self.ready = True
+            self.lock.release()
+    
+    def clear(self):
+        self.size = 0
+        self.offset = 0
+        self.results = {}
+    
+    def read_header(self):
+        try:
+            with open(self.store.log_path, 'rb') as f:
+                return f.readline()
+        except OSError:
+            return b""
+    
+    def read_from(self, offset):
+        """Append the sessions in the log after offset to the columns, a block at a time"""
+        with open(self.store.log_path, 'rb') as f:
+            f.seek(offset)
+            remainder = b""
+            while True:
+                block = f.read(self.READ_SIZE)
+                if not block:
+                    break
+                data = remainder + block
+                end = data.rfind(b"\n") + 1  # Carry a partial line into the next block, or the next refresh
+                remainder = data[end:]
+                self.parse_lines(data[:end])
+                offset += end
+                self.offset = offset
+    
+    def parse_lines(self, data):
+        rows = []
+        dates = []
+        for line in data.splitlines():
+            record = self.store.parse(line)
+            if record is None:
+                continue
+            if record['event'] == 'reset':
+                self.size = 0
+                rows = []
+                dates = []
+            elif record['event'] == 'session':
+                rows.append(self.row(record['data']))
+                dates.append(record['data'].get('date', ""))
+        self.append_rows(rows, dates)
+    
+    def add(self, session, log_start, log_end, **_):
+        """Take a session just logged at [log_start, log_end) if everything before it is parsed"""
+        if not self.lock.acquire(blocking=False):
+            return
+        try:
+            if self.ready and self.offset == log_start:
+                self.append_rows([self.row(session)], [session.get('date', "")])
+                self.offset = log_end
+        finally:
+            self.lock.release()
+    
+    @classmethod
+    def row(cls, s):
+        return (s['wpm'], s['accuracy'], s.get('avg_reaction_time', 0.0), s.get('difficulty', 0),
+                cls.TEXT_TYPES.index(s['text_type']) if s.get('text_type') in cls.TEXT_TYPES else -1)
+    
+    def append_rows(self, rows, dates):
+        self.results = {}
+        if not rows:
+            return
+        needed = self.size + len(rows)
+        if needed > len(self.columns):
+            grown = np.empty(max(needed, 2 * len(self.columns)), dtype=self.DTYPE)
+            grown[:self.size] = self.columns[:self.size]
+            self.columns = grown
+        new = self.columns[self.size:needed]
+        values = np.array(rows, dtype=np.float64).reshape(-1, 5)
+        new['date'] = np.array(dates, dtype='datetime64[s]')
+        new['wpm'] = values[:, 0]
+        new['accuracy'] = values[:, 1]
+        new['reaction'] = values[:, 2]
+        new['difficulty'] = values[:, 3]
+        new['text_type'] = values[:, 4]
+        self.size = needed
+        self.unsaved += len(rows)
+    
+    def load_cache(self, log_size):
+        """Start from the saved columns if they describe a prefix of the current log"""
+        try:
+            with open(self.cache_meta_path, 'r') as f:
+                meta = json.load(f)
+            if meta['header'] != self.header.decode('utf-8', 'replace') or meta['offset'] > log_size:
+                return
+            columns = np.load(self.cache_path)
+        except (OSError, ValueError, KeyError):
+            return
+        if columns.dtype != self.DTYPE or len(columns) != meta['size']:
+            return
+        self.columns = columns
+        self.size = len(columns)
+        self.offset = meta['offset']
+    
+    def save_cache(self):
+        try:
+            temp_path = self.cache_path + ".tmp.npy"
+            np.save(temp_path, self.columns[:self.size])
+            os.replace(temp_path, self.cache_path)
+            write_atomically(self.cache_meta_path, json.dumps({'header': self.header.decode('utf-8', 'replace'),
+                                                               'offset': self.offset, 'size': self.size}))
+            self.unsaved = 0
+        except OSError as e:
+            print(f"Error saving session columns: {e}")
+    
+    def view(self):
+        return self.columns[:self.size]
+    
+    def cached(self, key, compute):
+        if key not in self.results:
+            self.results[key] = compute()
+        return self.results[key]
+    
+    def trend(self, field, last=20):
+        """Least-squares change of field per session over the last sessions"""
+        def compute():
+            values = self.view()[field][-last:].astype(np.float64)
+            if len(values) < 2:
+                return 0.0
+            x = np.arange(len(values)) - (len(values) - 1) / 2
+            return float(x @ (values - values.mean()) / (x @ x))
+        return self.cached(('trend', field, last), compute)
+    
+    def rolling_mean(self, field, window=10):
+        """Mean of field over each run of window consecutive sessions"""
+        def compute():
+            values = self.view()[field].astype(np.float64)
+            if len(values) < window:
+                return np.empty(0)
+            sums = np.cumsum(np.concatenate(([0.0], values)))
+            return (sums[window:] - sums[:-window]) / window
+        return self.cached(('rolling', field, window), compute)
+    
+    def breakdown(self, field):
+        """Count and mean of field per (text type, difficulty); rows are text types, columns levels 1-5"""
+        def compute():
+            view = self.view()
+            known = (view['text_type'] >= 0) & (view['difficulty'] >= 1) & (view['difficulty'] <= self.LEVELS)
+            groups = view['text_type'][known].astype(np.intp) * self.LEVELS + view['difficulty'][known] - 1
+            size = len(self.TEXT_TYPES) * self.LEVELS
+            counts = np.bincount(groups, minlength=size)
+            sums = np.bincount(groups, weights=view[field][known], minlength=size)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                means = sums / counts
+            shape = (len(self.TEXT_TYPES), self.LEVELS)
+            return counts.reshape(shape), means.reshape(shape)
+        return self.cached(('breakdown', field), compute)
+    
+    def percentiles(self, field, ps=(10, 50, 90)):
+        def compute():
+            values = self.view()[field]
+            return np.percentile(values, ps) if len(values) else np.full(len(ps), np.nan)
+        return self.cached(('percentiles', field, tuple(ps)), compute)
+    
+    def percentile_bands(self, field, window=50, ps=(10, 50, 90)):
+        """Percentiles of field in consecutive blocks of window sessions, one row per block"""
+        def compute():
+            values = self.view()[field]
+            blocks = len(values) // window
+            if not blocks:
+                return np.empty((0, len(ps)))
+            return np.percentile(values[len(values) - blocks * window:].reshape(blocks, window), ps, axis=1).T
+        return self.cached(('bands', field, window, tuple(ps)), compute)
+
+class FeaturePipeline:
+    """Turns finished sessions into normalized inputs and labels for the difficulty model.
+    
+    The inputs describe the history up to a session; the label is the level the
+    outcome of the session after it called for, so the model learns where the
+    user will be next rather than restating the rule on what it can already see.
+    """
+    TREND_WINDOW = 5  # Sessions in the speed and accuracy trends
+    TEXT_TYPES = ("short", "medium", "long")
+    CONTINUOUS = 7    # difficulty, wpm, accuracy, reaction time, wpm trend, accuracy trend, error bursts
+    SIZE = CONTINUOUS + len(TEXT_TYPES)
+    VERSION = 2
+    
+    def __init__(self):
+        self.count = 0
+        self.mean = np.zeros(self.CONTINUOUS)
+        self.m2 = np.zeros(self.CONTINUOUS)
+    
+    @staticmethod
+    def slope(values):
+        """Least-squares change per session"""
+        n = len(values)
+        if n < 2:
+            return 0.0
+        x = np.arange(n) - (n - 1) / 2
+        return float(x @ (np.asarray(values) - np.mean(values)) / (x @ x))
+    
+    @classmethod
+    def features(cls, history):
+        """Raw feature row for the last session in history (oldest first)"""
+        window = [history[i] for i in range(-min(len(history), cls.TREND_WINDOW), 0)]
+        session = window[-1]
+        text_type = session.get('text_type')
+        text_length = session.get('text_length') or 1
+        # The label is relative to the level played, so the model has to see it
+        return ([session.get('difficulty', 2), session['wpm'], session['accuracy'], session['avg_reaction_time'],
+                 cls.slope([s['wpm'] for s in window]),
+                 cls.slope([s['accuracy'] for s in window]),
+                 100 * session.get('error_bursts', 0) / text_length]
+                + [1.0 if text_type == name else 0.0 for name in cls.TEXT_TYPES])
+    
+    @staticmethod
+    def label(session):
+        """Difficulty the session's outcome calls for; the target for the history before it"""
+        return float(DifficultyPolicy.fallback_level(session['difficulty'], session['wpm'], session['accuracy']))
+    
+    @classmethod
+    def training_samples(cls, sessions, limit=None):
+        """(features, label) pairs for the last limit sessions that have a next one, each with its own history"""
+        sessions = list(sessions)
+        begin = max(0, len(sessions) - 1 - limit) if limit else 0
+        return [(cls.features(sessions[max(0, i - cls.TREND_WINDOW + 1):i + 1]), [cls.label(sessions[i + 1])])
+                for i in range(begin, len(sessions) - 1)]
+    
+    def update(self, features):
+        """Fold one raw feature row into the running mean and variance"""
+        x = np.asarray(features[:self.CONTINUOUS], dtype=np.float64)
+        self.count += 1
+        delta = x - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (x - self.mean)
+    
+    def normalization(self):
+        """(mean, scale) arrays covering every feature; one-hot columns pass through"""
+        mean = np.zeros(self.SIZE, dtype=np.float32)
+        scale = np.ones(self.SIZE, dtype=np.float32)
+        if self.count > 1:
+            mean[:self.CONTINUOUS] = self.mean
+            scale[:self.CONTINUOUS] = np.maximum(np.sqrt(self.m2 / (self.count - 1)), 1e-3)
+        return mean, scale
+    
+    def to_dict(self):
+        return {'version': self.VERSION, 'count': self.count,
+                'mean': self.mean.tolist(), 'm2': self.m2.tolist()}
+    
+    @classmethod
+    def load(cls, path):
+        """Saved statistics from path; raises if missing or incompatible"""
+        with open(path, 'r') as f:
+            data = json.load(f)
+        if data.get('version') != cls.VERSION or len(data['mean']) != cls.CONTINUOUS:
+            raise ValueError(f"{path} was written for a different feature set")
+        pipeline = cls()
+        pipeline.count = data['count']
+        pipeline.mean = np.array(data['mean'])
+        pipeline.m2 = np.array(data['m2'])
+        return pipeline
+    
+    def save(self, path):
+        write_atomically(path, json.dumps(self.to_dict()))
+
+class NumpyDifficultyModel:
+    """Forward pass and SGD step of the dense difficulty network in plain NumPy"""
+    ACTIVATIONS = {
+        'relu': lambda x: np.maximum(x, 0),
+        'linear': lambda x: x
+    }
+
+    def __init__(self, layers, normalization=None):
+        # List of (kernel, bias, activation name) tuples, input layer first
+        self.layers = [(np.asarray(kernel, dtype=np.float32),
+                        np.asarray(bias, dtype=np.float32),
+                        self.ACTIVATIONS[activation])
+                       for kernel, bias, activation in layers]
+        self.activation_names = [activation for _, _, activation in layers]
+        self.normalization = normalization  # (mean, scale) applied to raw inputs, or None
+    
+    @property
+    def input_size(self):
+        return self.layers[0][0].shape[0]
+    
+    def normalize(self, X):
+        X = np.asarray(X, dtype=np.float32)
+        if self.normalization is None:
+            return X
+        mean, scale = self.normalization
+        return (X - mean) / scale
+    
+    @classmethod
+    def from_keras_file(cls, path, normalization=None):
+        """Read the Dense weights straight out of a .keras archive"""
+        import h5py  # Only needed here; Keras ships with it
+        
+        with zipfile.ZipFile(path) as archive:
+            config = json.loads(archive.read('config.json'))
+            weights = io.BytesIO(archive.read('model.weights.h5'))
+        
+        layers = []
+        with h5py.File(weights, 'r') as f:
+            for layer in config['config']['layers']:
+                if layer['class_name'] != 'Dense':
+                    continue
+                layer_vars = f['layers'][layer['config']['name']]['vars']
+                layers.append((layer_vars['0'][()], layer_vars['1'][()], layer['config']['activation']))
+        return cls(layers, normalization)
+    
+    @classmethod
+    def from_keras_model(cls, model, normalization=None):
+        """Copy the current weights out of a live Keras model"""
+        layers = []
+        for layer in model.layers:
+            kernel, bias = layer.get_weights()
+            layers.append((kernel, bias, layer.activation.__name__))
+        return cls(layers, normalization)
+    
+    def predict(self, X):
+        output = self.normalize(X)
+        for kernel, bias, activation in self.layers:
+            output = activation(output @ kernel + bias)
+        return output
+    
+    @staticmethod
+    def predict_each(models, X):
+        """Row i of X through models[i], as one stacked forward pass per network shape"""
+        X = np.asarray(X, dtype=np.float32)
+        predictions = np.empty(len(models), dtype=np.float32)
+        groups = {}
+        for i, model in enumerate(models):
+            shape = tuple((kernel.shape, name) for (kernel, _, _), name in zip(model.layers, model.activation_names))
+            groups.setdefault(shape, []).append(i)
+        for rows in groups.values():
+            group = [models[i] for i in rows]
+            output = np.stack([model.normalize(X[i]) for model, i in zip(group, rows)])
+            for layer in range(len(group[0].layers)):
+                kernels = np.stack([model.layers[layer][0] for model in group])
+                biases = np.stack([model.layers[layer][1] for model in group])
+                output = group[0].layers[layer][2](np.einsum('ni,nio->no', output, kernels) + biases)
+            predictions[rows] = output[:, 0]
+        return predictions
+    
+    def copy(self):
+        """Independent copy whose weights can be fine-tuned"""
+        layers = [(kernel.copy(), bias.copy(), name)
+                  for (kernel, bias, _), name in zip(self.layers, self.activation_names)]
+        normalization = None if self.normalization is None else tuple(a.copy() for a in self.normalization)
+        return NumpyDifficultyModel(layers, normalization)
+    
+    def sgd_step(self, X, y, learning_rate=0.01):
+        """One gradient descent step on mean squared error; returns the loss before the step"""
+        inputs = []
+        pre_activations = []
+        output = self.normalize(X)
+        for kernel, bias, activation in self.layers:
+            inputs.append(output)
+            pre_activations.append(output @ kernel + bias)
+            output = activation(pre_activations[-1])
+        error = output - np.asarray(y, dtype=np.float32).reshape(output.shape)
+        
+        grad = 2 * error / len(error)
+        for i in reversed(range(len(self.layers))):
+            kernel, bias, _ = self.layers[i]
+            if self.activation_names[i] == 'relu':
+                grad = grad * (pre_activations[i] > 0)
+            kernel_grad = inputs[i].T @ grad
+            bias_grad = grad.sum(axis=0)
+            grad = grad @ kernel.T
+            kernel -= learning_rate * kernel_grad
+            bias -= learning_rate * bias_grad
+        return float(np.mean(error ** 2))
+    
+    def save(self, path):
+        """Atomically write the weights and input scaling to an .npz file"""
+        arrays = {}
+        for i, (kernel, bias, _) in enumerate(self.layers):
+            arrays[f"kernel{i}"] = kernel
+            arrays[f"bias{i}"] = bias
+        if self.normalization is not None:
+            arrays['mean'], arrays['scale'] = self.normalization
+        temp_path = path + ".tmp"
+        with open(temp_path, 'wb') as f:
+            np.savez(f, activations=np.array(self.activation_names), **arrays)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+    
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            names = [str(name) for name in data['activations']]
+            layers = [(data[f"kernel{i}"], data[f"bias{i}"], name) for i, name in enumerate(names)]
+            normalization = (data['mean'], data['scale']) if 'mean' in data else None
+        return cls(layers, normalization)
+
+class PredictionBatcher:
+    """Collects single-row predictions on a worker thread and runs them as one batch"""
+    def __init__(self, predict_batch, max_batch=64, max_delay=0.005):
+        self.predict_batch = predict_batch  # Maps a list of n submitted rows to n predictions
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.requests = queue.Queue()
+        self.worker = None
+        self.lock = threading.Lock()
+        self.request_count = 0
+        self.batch_count = 0
+        self.max_queue_depth = 0
+    
+    def submit(self, row):
+        """Queue one feature row for prediction; returns a future"""
+        future = Future()
+        with self.lock:
+            if self.worker is None:
+                self.worker = threading.Thread(target=self.run, name="model-batcher", daemon=True)
+                self.worker.start()
+        self.requests.put((row, future))
+        return future
+    
+    def close(self, timeout=1):
+        if self.worker is not None:
+            self.requests.put(None)
+            self.worker.join(timeout)
+    
+    def run(self):
+        stopping = False
+        while not stopping:
+            item = self.requests.get()
+            if item is None:
+                break
+            depth = self.requests.qsize() + 1
+            batch = [item]
+            deadline = time.monotonic() + self.max_delay
+            while len(batch) < self.max_batch:
+                try:
+                    item = self.requests.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            self.run_batch(batch, depth)
+    
+    def run_batch(self, batch, depth):
+        live = [(row, future) for row, future in batch if future.set_running_or_notify_cancel()]
+        with self.lock:
+            self.request_count += len(batch)
+            self.batch_count += 1
+            self.max_queue_depth = max(self.max_queue_depth, depth)
+        if not live:
+            return
+        try:
+            predictions = self.predict_batch([row for row, _ in live])
+        except Exception as e:
+            for _, future in live:
+                future.set_exception(e)
+            return
+        for (_, future), prediction in zip(live, predictions):
+            future.set_result(float(prediction))
+    
+    def stats(self):
+        """Queue depth and batch fill counters"""
+        with self.lock:
+            batches = self.batch_count
+            mean_batch = self.request_count / batches if batches else 0.0
+            return {
+                'queue_depth': self.requests.qsize(),
+                'max_queue_depth': self.max_queue_depth,
+                'requests': self.request_count,
+                'batches': batches,
+                'mean_batch': mean_batch,
+                'batch_fill': mean_batch / self.max_batch
+            }
+
+class ModelService:
+    """Shared difficulty model, loaded lazily and trained on a background thread"""
+    REPLAY_SIZE = 512       # Most recent sessions kept for replay
+    BATCH_SIZE = 32         # Sessions per training step
+    CHECKPOINT_DELAY = 30   # Seconds without new sessions before saving
+
+    def __init__(self, model_path, session_store, debug=False, max_batch=64, max_delay=0.005):
+        self.model_path = model_path
+        self.session_store = session_store
+        self.debug = debug
+        self.model = None
+        self.predictor = None
+        self.tf = None
+        self.batcher = PredictionBatcher(self.predict_batch, max_batch, max_delay)
+        self.features_path = os.path.splitext(model_path)[0] + ".features.json"
+        try:
+            self.features = FeaturePipeline.load(self.features_path)
+        except (OSError, ValueError, KeyError):
+            self.features = FeaturePipeline()
+        
+        # Online training state, owned by the trainer thread
+        self.samples = queue.Queue()
+        self.replay_buffer = deque(maxlen=self.REPLAY_SIZE)
+        self.rng = np.random.default_rng()
+        self.dirty = False
+        self.trainer = None
+        self.seed_replay_buffer()
+    
+    def get_model(self):
+        if self.model is None:
+            self.model = self.load_or_create_model()
+        return self.model
+    
+    def predict(self, history):
+        """Predict the next difficulty after the last session in history; returns a future"""
+        return self.batcher.submit(FeaturePipeline.features(history))
+    
+    def predict_batch(self, rows):
+        predictor = self.predictor
+        if predictor is None:
+            predictor = self.predictor = self.load_predictor()
+        return predictor.predict(np.array(rows, dtype=np.float32))[:, 0]
+    
+    def load_predictor(self):
+        """Load the NumPy predictor straight from the saved model file"""
+        if not os.path.exists(self.model_path) or self.features.count < 2:
+            raise FileNotFoundError(f"{self.model_path} has not been trained yet")
+        predictor = NumpyDifficultyModel.from_keras_file(self.model_path, self.features.normalization())
+        if predictor.input_size != FeaturePipeline.SIZE:
+            raise ValueError(f"{self.model_path} was trained on different features")
+        return predictor
+    
+    def add_sample(self, history):
+        """Queue the history before the last session in it, labelled by that session, for the trainer thread"""
+        samples = FeaturePipeline.training_samples(history, 1)
+        if not samples:
+            return  # The first session has no history to learn from
+        if self.trainer is None:
+            self.trainer = threading.Thread(target=self.training_loop, name="model-trainer", daemon=True)
+            self.trainer.start()
+        self.samples.put(samples[0])
+    
+    def shutdown(self, timeout=10):
+        """Stop the trainer, writing a checkpoint if there are unsaved updates"""
+        if self.trainer is not None:
+            self.samples.put(None)
+            self.trainer.join(timeout)
+        self.batcher.close()
+    
+    def training_loop(self):
+        stopping = False
+        while not stopping:
+            try:
+                # Wake up to checkpoint once no new sessions arrived for a while
+                sample = self.samples.get(timeout=self.CHECKPOINT_DELAY if self.dirty else None)
+            except queue.Empty:
+                self.save_checkpoint()
+                continue
+            
+            # Take everything that queued up while the last step was running
+            new_samples = 0
+            while True:
+                if sample is None:
+                    stopping = True
+                else:
+                    self.features.update(sample[0])
+                    self.replay_buffer.append(sample)
+                    new_samples += 1
+                try:
+                    sample = self.samples.get_nowait()
+                except queue.Empty:
+                    break
+            
+            if new_samples:
+                self.train_step()
+        self.save_checkpoint()
+    
+    def seed_replay_buffer(self):
+        """Fill the replay buffer from the saved performance history"""
+        if self.session_store is None:
+            return
+        seed_statistics = self.features.count == 0  # Saved statistics already cover these sessions
+        for sample in FeaturePipeline.training_samples(self.session_store.recent, self.REPLAY_SIZE):
+            if seed_statistics:
+                self.features.update(sample[0])
+            self.replay_buffer.append(sample)
+    
+    def train_step(self):
+        """Train on a mini-batch of the newest session plus replayed ones"""
+        try:
+            model = self.get_model()
+            size = len(self.replay_buffer)
+            picks = self.rng.choice(size - 1, min(self.BATCH_SIZE, size) - 1, replace=False) if size > 1 else []
+            batch = [self.replay_buffer[i] for i in picks] + [self.replay_buffer[-1]]
+            normalization = self.features.normalization()
+            mean, scale = normalization
+            X = (np.array([features for features, _ in batch], dtype=np.float32) - mean) / scale
+            y = np.array([label for _, label in batch], dtype=np.float32)
+            model.train_on_batch(X, y)
+            
+            # Publish the new weights and their scaling to the inference path in one assignment
+            self.predictor = NumpyDifficultyModel.from_keras_model(model, normalization)
+            self.dirty = True
+        except Exception as e:
+            print(f"Error updating model: {e}")
+    
+    def save_checkpoint(self):
+        """Atomically replace the model file with the current weights"""
+        if not self.dirty:
+            return
+        try:
+            root, ext = os.path.splitext(self.model_path)
+            temp_path = f"{root}.tmp{ext}"
+            self.features.save(self.features_path)
+            self.model.save(temp_path)  # Use .keras format
+            os.replace(temp_path, self.model_path)
+            self.dirty = False
+        except Exception as e:
+            print(f"Error saving model: {e}")
+    
+    def check_parity(self, samples=1000):
+        """Compare NumPy and Keras predictions on random inputs; returns the max abs difference"""
+        rng = np.random.default_rng(0)
+        predictor = self.load_predictor()
+        mean, scale = predictor.normalization
+        continuous = FeaturePipeline.CONTINUOUS
+        X = np.column_stack([mean[:continuous] + scale[:continuous] * rng.normal(size=(samples, continuous)),
+                             np.eye(len(FeaturePipeline.TEXT_TYPES))[rng.integers(0, 3, samples)]]).astype(np.float32)
+        expected = self.get_model().predict(predictor.normalize(X), verbose=0)
+        actual = predictor.predict(X)
+        return float(np.max(np.abs(expected - actual)))
+    
+    def import_tensorflow(self):
+        """Import TensorFlow on first use so that startup does not pay for it"""
+        if self.tf is None:
+            import tensorflow as tf
+            if self.debug:
+                tf.config.run_functions_eagerly(True)  # Ensure eager execution for debugging
+                tf.data.experimental.enable_debug_mode()  # Enable debug mode for tf.data functions
+            self.tf = tf
+        return self.tf
+    
+    def load_or_create_model(self):
+        """Load existing model or create a new one"""
+        tf = self.import_tensorflow()
+        try:
+            if os.path.exists(self.model_path):
+                # Load the model
+                model = tf.keras.models.load_model(self.model_path)
+                if model.input_shape[-1] != FeaturePipeline.SIZE:
+                    print("Saved model uses different features, creating a new model")
+                    return self.create_new_model()
+                print("Loaded existing model")
+                
+                # Recompile the model to reset the optimizer
+                model.compile(optimizer='adam', loss=tf.keras.losses.MeanSquaredError())
+            else:
+                model = self.create_new_model()
+                print("Created new model")
+            return model
+        except Exception as e:
+            print(f"Error loading/creating model: {e}")
+            return self.create_new_model()
+
+    def create_new_model(self):
+        """Create a new neural network model"""
+        tf = self.import_tensorflow()
+        model = tf.keras.Sequential([
+            tf.keras.layers.Input(shape=(FeaturePipeline.SIZE,)),  # Explicitly define the input shape
+            tf.keras.layers.Dense(16, activation='relu'),
+            tf.keras.layers.Dense(8, activation='relu'),
+            tf.keras.layers.Dense(1, activation='linear')
+        ])
+        model.compile(optimizer='adam', loss=tf.keras.losses.MeanSquaredError())  # Use the class explicitly
+        return model
+
+class ModelRegistry:
+    """Per-user fine-tuned copies of the shared model, kept in an LRU and saved as .npz"""
+    FINE_TUNE_SESSIONS = 8  # Newest sessions in each fine-tuning step
+    LEARNING_RATE = 0.01
+    
+    def __init__(self, service, directory, capacity=32):
+        self.service = service
+        self.directory = directory
+        self.capacity = capacity
+        self.models = OrderedDict()  # user -> [NumpyDifficultyModel, dirty]
+        self.lock = threading.Lock()
+        self.tuning = threading.Lock()  # One fine-tuning step at a time, so no swap undoes another
+        # Personal models are batched like the shared one, with each row carrying its model
+        self.batcher = PredictionBatcher(self.predict_batch, service.batcher.max_batch, service.batcher.max_delay)
+        os.makedirs(directory, exist_ok=True)
+    
+    def model_path(self, user):
+        return os.path.join(self.directory, f"{user}.npz")
+    
+    def get(self, user):
+        """The user's model, loading or creating it; None until a shared model exists"""
+        with self.lock:
+            entry = self.models.get(user)
+            if entry is not None:
+                self.models.move_to_end(user)
+                return entry[0]
+        
+        path = self.model_path(user)
+        dirty = False
+        try:
+            model = NumpyDifficultyModel.load(path) if os.path.exists(path) else None
+            if model is None or model.input_size != FeaturePipeline.SIZE:  # Missing, or from older features
+                if self.service.predictor is None:
+                    self.service.predictor = self.service.load_predictor()
+                model = self.service.predictor.copy()
+                dirty = True
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Error loading model for {user}: {e}")
+            return None
+        if model.input_size != FeaturePipeline.SIZE:
+            return None
+        
+        with self.lock:
+            self.models[user] = [model, dirty]
+            evicted = []
+            while len(self.models) > self.capacity:
+                evicted.append(self.models.popitem(last=False))
+        for evicted_user, (evicted_model, evicted_dirty) in evicted:
+            if evicted_dirty:
+                self.write_back(evicted_user, evicted_model)
+        return model
+    
+    def write_back(self, user, model):
+        try:
+            model.save(self.model_path(user))
+        except OSError as e:
+            print(f"Error saving model for {user}: {e}")
+    
+    def predict(self, user, history):
+        """Predict with the user's own model, or the shared one if there is none yet; returns a future"""
+        model = self.get(user)
+        if model is None:
+            return self.service.predict(history)
+        return self.batcher.submit((model, FeaturePipeline.features(history)))
+    
+    @staticmethod
+    def predict_batch(rows):
+        return NumpyDifficultyModel.predict_each([model for model, _ in rows], [features for _, features in rows])
+    
+    def add_sample(self, user, history):
+        """Train the shared model on the session and fine-tune the user's copy on their own next-session outcomes"""
+        self.service.add_sample(history)
+        samples = FeaturePipeline.training_samples(history, self.FINE_TUNE_SESSIONS)
+        if not samples:
+            return
+        with self.tuning:
+            model = self.get(user)
+            if model is None:
+                return
+            # Predictions may be reading the published weights, so step a copy and swap it in
+            tuned = model.copy()
+            tuned.sgd_step([features for features, _ in samples], [label for _, label in samples], self.LEARNING_RATE)
+            with self.lock:
+                if user in self.models:
+                    self.models[user] = [tuned, True]
+                    return
+            self.write_back(user, tuned)  # Evicted while we trained
+    
+    def flush(self):
+        """Write every modified model to disk"""
+        with self.lock:
+            dirty = [(user, entry[0]) for user, entry in self.models.items() if entry[1]]
+            for entry in self.models.values():
+                entry[1] = False
+        for user, model in dirty:
+            self.write_back(user, model)
+    
+    def shutdown(self):
+        self.batcher.close()
+        self.flush()
+        self.service.shutdown()
+
+class UserModelService:
+    """The ModelService interface for one user of a ModelRegistry, run on a worker thread"""
+    def __init__(self, registry, user):
+        self.registry = registry
+        self.user = user
+        self.requests = queue.Queue()  # (function, args, future), or None to stop
+        self.worker = None
+    
+    def submit(self, function, *args):
+        """Run function(*args) on the worker, in order; returns a future of its result"""
+        if self.worker is None:
+            self.worker = threading.Thread(target=self.run, name="user-model", daemon=True)
+            self.worker.start()
+        future = Future()
+        self.requests.put((function, args, future))
+        return future
+    
+    def run(self):
+        while True:
+            item = self.requests.get()
+            if item is None:
+                break
+            function, args, future = item
+            try:
+                future.set_result(function(*args))
+            except Exception as e:
+                future.set_exception(e)
+    
+    def predict(self, history):
+        # Loading the user's model reads files and may import h5py, so even that is kept off the Tk thread
+        return self.submit(lambda history: self.registry.predict(self.user, history).result(), list(history))
+    
+    def add_sample(self, history):
+        self.submit(self.registry.add_sample, self.user, list(history))
+    
+    def shutdown(self, timeout=10):
+        if self.worker is not None:
+            self.requests.put(None)
+            self.worker.join(timeout)
+        self.registry.shutdown()
+
+class EventBus:
+    """Synchronous publish/subscribe hub; handlers get the payload as keyword arguments"""
+    def __init__(self):
+        self.handlers = {}  # event name -> list of callables
+    
+    def subscribe(self, event, handler):
+        self.handlers.setdefault(event, []).append(handler)
+    
+    def publish(self, event, **payload):
+        for handler in list(self.handlers.get(event, ())):
+            try:
+                handler(**payload)
+            except Exception as e:
+                print(f"Error handling {event}: {e}")
+
+class UIRefreshScheduler:
+    """Moves metric label updates from background threads onto the Tk thread"""
+    def __init__(self, widget, interval=50):
+        self.widget = widget
+        self.interval = interval  # Milliseconds between queue drains
+        self.queue = queue.Queue()
+        self.labels = {}
+        self.shown = {}
+        self.generation = 0
+        self.widget.after(self.interval, self.drain)
+    
+    def bind(self, key, label):
+        self.labels[key] = label
+        self.shown[key] = label.cget("text")
+    
+    def push(self, generation, **texts):
+        """Queue new label texts; safe to call from any thread"""
+        self.queue.put((generation, texts))
+    
+    def set(self, key, text):
+        """Update a label right away; Tk thread only"""
+        if self.shown[key] != text:
+            self.labels[key].config(text=text)
+            self.shown[key] = text
+    
+    def reset(self):
+        """Start a new generation, discarding snapshots still in flight"""
+        self.generation += 1
+        while True:
+            try:
+                self.queue.get_nowait()
+            except queue.Empty:
+                break
+    
+    def drain(self):
+        latest = {}
+        while True:
+            try:
+                generation, texts = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if generation == self.generation:
+                latest.update(texts)
+        for key, text in latest.items():
+            self.set(key, text)
+        self.widget.after(self.interval, self.drain)
+
+class IncrementalComparator:
+    """Tracks how much of the typed input matches the sample text, re-checking only what changed"""
+    def __init__(self, target):
+        self.target = target
+        self.text = ""
+        self.matches = bytearray()  # 1 where text[i] == target[i]
+        self.correct = 0
+        self.first_error = -1       # Index of the first mismatch, -1 if none
+    
+    @staticmethod
+    def common_prefix_length(a, b):
+        """Length of the common prefix, found by bisecting with C-level slice compares"""
+        lo, hi = 0, min(len(a), len(b))
+        if a[:hi] == b[:hi]:
+            return hi
+        while hi - lo > 1:
+            mid = (lo + hi) // 2
+            if a[:mid] == b[:mid]:
+                lo = mid
+            else:
+                hi = mid
+        return lo
+    
+    def update(self, text):
+        """Bring the counts up to date with the current input text"""
+        start = self.common_prefix_length(self.text, text)
+        
+        # Forget everything from the first changed character on
+        self.correct -= sum(self.matches[start:])
+        del self.matches[start:]
+        
+        target = self.target
+        target_len = len(target)
+        for i in range(start, len(text)):
+            match = i < target_len and text[i] == target[i]
+            self.matches.append(match)
+            self.correct += match
+        self.text = text
+        
+        if self.first_error == -1 or self.first_error >= start:
+            self.first_error = self.matches.find(0, start)
+    
+    def accuracy(self):
+        return (self.correct / len(self.text)) * 100 if self.text else 0
+    
+    def is_prefix(self):
+        """True while the input is an error-free prefix of the sample text"""
+        return self.first_error == -1
+    
+    def is_complete(self):
+        return len(self.text) == len(self.target) and self.correct == len(self.target)
+
+class LatencyHistogram:
+    """Constant-memory histogram of inter-key gaps, with 2% wide buckets from 1ms to 60s"""
+    MIN_VALUE = 0.001   # Seconds; faster gaps share the first bucket
+    MAX_VALUE = 60.0    # Seconds; slower gaps share the last bucket
+    GROWTH = 1.02
+    BUCKETS = int(math.ceil(math.log(MAX_VALUE / MIN_VALUE) / math.log(GROWTH))) + 1
+    INV_LOG_GROWTH = 1 / math.log(GROWTH)
+    
+    def __init__(self):
+        self.counts = [0] * self.BUCKETS  # A list is cheaper to bump per key than an array
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = 0.0
+    
+    @classmethod
+    def bucket(cls, value):
+        if value <= cls.MIN_VALUE:
+            return 0
+        return min(cls.BUCKETS - 1, int(math.log(value / cls.MIN_VALUE) * cls.INV_LOG_GROWTH))
+    
+    def record(self, value):
+        self.counts[self.bucket(value)] += 1
+        self.count += 1
+        self.total += value
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+    
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+    
+    def percentile(self, p):
+        """Value below which p percent of the gaps fall"""
+        if not self.count:
+            return 0.0
+        rank = max(1, int(math.ceil(p / 100 * self.count)))
+        index = int(np.searchsorted(np.cumsum(self.counts), rank))
+        value = self.MIN_VALUE * self.GROWTH ** (index + 0.5)  # Geometric middle of the bucket
+        return min(max(value, self.min), self.max)
+    
+    def percentiles(self, ps=(50, 90, 99)):
+        return {p: self.percentile(p) for p in ps}
+    
+    def to_dict(self):
+        """Sparse form for the session log"""
+        return {'growth': self.GROWTH, 'min_value': self.MIN_VALUE,
+                'min': self.min if self.count else 0.0, 'max': self.max, 'sum': self.total,
+                'buckets': [[i, count] for i, count in enumerate(self.counts) if count]}
+    
+    @classmethod
+    def from_dict(cls, data):
+        histogram = cls()
+        for index, count in data['buckets']:
+            histogram.counts[index] = count
+        histogram.count = sum(histogram.counts)
+        histogram.total = data['sum']
+        histogram.min = data['min'] if histogram.count else math.inf
+        histogram.max = data['max']
+        return histogram
+
+class LiveMetrics:
+    """Streaming speed and rhythm metrics for the test in progress.
+    
+    Gross WPM counts every typed character, net WPM subtracts uncorrected
+    errors, and the displayed speed is an EWMA of net WPM.
+    """
+    CHARS_PER_WORD = 5
+
+    def __init__(self, smoothing=0.3):
+        self.smoothing = smoothing  # EWMA weight of the newest WPM sample
+        self.reset()
+    
+    def reset(self):
+        self.start_time = None
+        self.typed_chars = 0
+        self.errors = 0
+        self.smoothed_wpm = None
+        self.reactions = LatencyHistogram()
+    
+    def start(self, start_time):
+        self.start_time = start_time
+    
+    def record_gap(self, gap):
+        """Add the time between two keystrokes"""
+        self.reactions.record(gap)
+    
+    def update_text(self, typed_chars, errors):
+        """Record the current input length and how many of its characters are wrong"""
+        self.typed_chars = typed_chars
+        self.errors = errors
+    
+    def elapsed(self, now):
+        return now - self.start_time if self.start_time is not None else 0.0
+    
+    def gross_wpm(self, now):
+        minutes = self.elapsed(now) / 60
+        return (self.typed_chars / self.CHARS_PER_WORD) / minutes if minutes > 0 else 0.0
+    
+    def net_wpm(self, now):
+        minutes = self.elapsed(now) / 60
+        if minutes <= 0:
+            return 0.0
+        return max(0.0, (self.typed_chars / self.CHARS_PER_WORD - self.errors) / minutes)
+    
+    def tick(self, now):
+        """Fold the current net WPM into the moving average and return it"""
+        wpm = self.net_wpm(now)
+        if self.smoothed_wpm is None:
+            self.smoothed_wpm = wpm
+        else:
+            self.smoothed_wpm += self.smoothing * (wpm - self.smoothed_wpm)
+        return self.smoothed_wpm
+    
+    def reaction_mean(self):
+        """Mean inter-key gap over the session so far"""
+        return self.reactions.mean()
+
+class KeystrokeRecorder:
+    """Per-keystroke event log kept in typed arrays and saved as a small binary file"""
+    MAGIC = b"TTKS"
+    VERSION = 1
+    HEADER = struct.Struct("<4sIdI4x")  # magic, version, start time (epoch seconds), keystrokes
+    COLUMNS = (('timestamps', 'd'), ('keycodes', 'H'), ('positions', 'I'), ('flags', 'b'))
+
+    def __init__(self):
+        self.clear()
+    
+    def clear(self, start_time=0.0):
+        self.start_time = start_time
+        self.timestamps = array.array('d')
+        self.keycodes = array.array('H')
+        self.positions = array.array('I')
+        self.flags = array.array('b')
+    
+    def __len__(self):
+        return len(self.timestamps)
+    
+    def record(self, timestamp, keycode, position, flag):
+        self.timestamps.append(timestamp - self.start_time)
+        self.keycodes.append(keycode & 0xFFFF)
+        self.positions.append(position)
+        self.flags.append(flag)
+    
+    def save(self, path):
+        """Write the columns to a little-endian binary file"""
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(self.HEADER.pack(self.MAGIC, self.VERSION, self.start_time, len(self)))
+            for name, _ in self.COLUMNS:
+                column = getattr(self, name)
+                if sys.byteorder == 'big':
+                    column = array.array(column.typecode, column)
+                    column.byteswap()
+                column.tofile(f)
+    
+    @classmethod
+    def load(cls, path):
+        """Read a saved keystroke file back into a recorder"""
+        recorder = cls()
+        with open(path, 'rb') as f:
+            magic, version, start_time, count = cls.HEADER.unpack(f.read(cls.HEADER.size))
+            if magic != cls.MAGIC or version != cls.VERSION:
+                raise ValueError(f"{path} is not a keystroke file")
+            recorder.start_time = start_time
+            for name, typecode in cls.COLUMNS:
+                column = array.array(typecode)
+                column.fromfile(f, count)
+                if sys.byteorder == 'big':
+                    column.byteswap()
+                setattr(recorder, name, column)
+        return recorder
+
+class ErrorProfile:
+    """Per-key and per-bigram error and latency counters.
+    
+    The counters are array.array buffers, cheap to bump on the key path;
+    the NumPy attributes are views of the same memory.
+    """
+    SIZE = 96  # Printable ASCII plus one slot for everything else
+    FIELDS = ('char_attempts', 'char_errors', 'char_latency',
+              'bigram_attempts', 'bigram_errors', 'bigram_latency')
+    
+    def __init__(self):
+        self.counters = []
+        for field in self.FIELDS:
+            shape = (self.SIZE, self.SIZE) if field.startswith('bigram') else (self.SIZE,)
+            typecode, dtype = ('f', np.float32) if field.endswith('latency') else ('i', np.int32)
+            counter = array.array(typecode, bytes(4 * int(np.prod(shape))))
+            self.counters.append(counter)
+            # Latencies are summed seconds before the key; bigrams are [previous, current]
+            setattr(self, field, np.frombuffer(counter, dtype=dtype).reshape(shape))
+    
+    @classmethod
+    def slot(cls, char):
+        code = ord(char) - 32
+        return code if 0 <= code < cls.SIZE - 1 else cls.SIZE - 1
+    
+    @classmethod
+    def char(cls, slot):
+        return chr(slot + 32) if slot < cls.SIZE - 1 else "?"
+    
+    def record(self, expected, previous, error, latency):
+        """Count one typed character; previous is the expected character before it, or None"""
+        char_attempts, char_errors, char_latency, bigram_attempts, bigram_errors, bigram_latency = self.counters
+        i = self.slot(expected)
+        char_attempts[i] += 1
+        char_errors[i] += error
+        char_latency[i] += latency
+        if previous is not None:
+            k = self.slot(previous) * self.SIZE + i
+            bigram_attempts[k] += 1
+            bigram_errors[k] += error
+            bigram_latency[k] += latency
+    
+    def merge(self, other):
+        """Add another profile's counters, or the characters a SessionErrors recorded, to this one"""
+        if isinstance(other, ErrorProfile):
+            for field in self.FIELDS:
+                getattr(self, field)[...] += getattr(other, field)
+            return
         
-        reset_button = ttk.Button(button_frame,
-                                text="Reset Stats",
-                                command=self.reset_stats)
-        reset_button.pack(side="left", padx=5)
+        slots = np.frombuffer(other.slots, dtype=np.int32)
+        previous = np.frombuffer(other.previous, dtype=np.int32)
+        errors = np.frombuffer(other.errors, dtype=np.int8)
+        latencies = np.frombuffer(other.latencies, dtype=np.float32)
+        np.add.at(self.char_attempts, slots, 1)
+        np.add.at(self.char_errors, slots, errors)
+        np.add.at(self.char_latency, slots, latencies)
+        pair = previous >= 0
+        bigrams = previous[pair] * self.SIZE + slots[pair]
+        np.add.at(self.bigram_attempts.reshape(-1), bigrams, 1)
+        np.add.at(self.bigram_errors.reshape(-1), bigrams, errors[pair])
+        np.add.at(self.bigram_latency.reshape(-1), bigrams, latencies[pair])
     
-    def update_stats(self):
+    def weak_keys(self, count=5, min_attempts=10):
+        """(character, error rate, mean latency) of the most error-prone keys"""
+        attempts = self.char_attempts
+        with np.errstate(invalid='ignore', divide='ignore'):
+            rates = np.where(attempts >= min_attempts, self.char_errors / attempts, -1.0)
+            latencies = self.char_latency / attempts
+        order = np.argsort(-rates, kind='stable')[:count]
+        return [(self.char(i), float(rates[i]), float(latencies[i])) for i in order if rates[i] > 0]
+    
+    def weak_bigrams(self, count=5, min_attempts=5):
+        """(bigram, error rate, mean latency) of the most error-prone character pairs"""
+        attempts = self.bigram_attempts
+        with np.errstate(invalid='ignore', divide='ignore'):
+            rates = np.where(attempts >= min_attempts, self.bigram_errors / attempts, -1.0).ravel()
+            latencies = (self.bigram_latency / attempts).ravel()
+        order = np.argsort(-rates, kind='stable')[:count]
+        return [(self.char(i // self.SIZE) + self.char(i % self.SIZE), float(rates[i]), float(latencies[i]))
+                for i in order if rates[i] > 0]
+    
+    def save(self, path):
+        temp_path = path + ".tmp"
+        with open(temp_path, 'wb') as f:
+            np.savez(f, **{field: getattr(self, field) for field in self.FIELDS})
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+    
+    @classmethod
+    def load(cls, path):
+        """The saved profile at path, or an empty one"""
+        profile = cls()
         try:
-            with open('typing_stats.json', 'r') as f:
-                stats = json.load(f)
-            
-            self.stats_text.config(state=tk.NORMAL)
-            self.stats_text.delete(1.0, tk.END)
-            
-            # Calculate averages
-            total_sessions = len(stats['sessions'])
-            if total_sessions > 0:
-                avg_wpm = sum(s['wpm'] for s in stats['sessions']) / total_sessions
-                avg_accuracy = sum(s['accuracy'] for s in stats['sessions']) / total_sessions
-                avg_reaction = sum(s['avg_reaction_time'] for s in stats['sessions']) / total_sessions
-                
-                self.stats_text.insert(tk.END, f"Total Sessions: {total_sessions}\n")
-                self.stats_text.insert(tk.END, f"Average WPM: {avg_wpm:.2f}\n")
-                self.stats_text.insert(tk.END, f"Average Accuracy: {avg_accuracy:.2f}%\n")
-                self.stats_text.insert(tk.END, f"Average Reaction Time: {avg_reaction:.2f} sec\n\n")
-                
-                # AI recommendations
-                if avg_wpm < 30:
-                    self.stats_text.insert(tk.END, "AI Suggestion: Focus on accuracy first, then gradually increase speed.\n")
-                elif avg_wpm < 50:
-                    self.stats_text.insert(tk.END, "AI Suggestion: Practice with medium-length texts to build consistency.\n")
-                else:
-                    self.stats_text.insert(tk.END, "AI Suggestion: Challenge yourself with long texts and complex vocabulary.\n")
-                
-                if avg_accuracy < 90:
-                    self.stats_text.insert(tk.END, "AI Suggestion: Slow down to improve accuracy. Speed will come naturally.\n")
-                
-                # Recent sessions
-                self.stats_text.insert(tk.END, "\nRecent Sessions:\n")
-                for session in stats['sessions'][-5:]:
-                    self.stats_text.insert(tk.END, 
-                        f"{session['date']}: {session['wpm']:.1f} WPM, {session['accuracy']:.1f}% accuracy\n")
-            else:
-                self.stats_text.insert(tk.END, "No data available yet. Complete some typing tests first!")
-            
-            self.stats_text.config(state=tk.DISABLED)
+            with np.load(path) as data:
+                for field in cls.FIELDS:
+                    getattr(profile, field)[...] = data[field]
         except FileNotFoundError:
-            self.stats_text.config(state=tk.NORMAL)
-            self.stats_text.delete(1.0, tk.END)
-            self.stats_text.insert(tk.END, "No data available yet. Complete some typing tests first!")
-            self.stats_text.config(state=tk.DISABLED)
+            pass
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Error loading error profile {path}: {e}")
+        return profile
+    
+    @staticmethod
+    def path_for(store):
+        """Profile file kept beside a session store's log"""
+        return os.path.splitext(store.log_path)[0] + ".errors.npz"
 
-    def reset_stats(self):
-        """Reset the stats by clearing the typing_stats.json file."""
+class SessionErrors:
+    """The characters typed in one test as (slot, previous slot, error, latency) rows for ErrorProfile.merge"""
+    def __init__(self):
+        self.slots = array.array('i')
+        self.previous = array.array('i')  # -1 for the first character
+        self.errors = array.array('b')
+        self.latencies = array.array('f')
+    
+    def __len__(self):
+        return len(self.slots)
+    
+    def record(self, expected, previous, error, latency):
+        """Same arguments as ErrorProfile.record"""
+        self.slots.append(ErrorProfile.slot(expected))
+        self.previous.append(-1 if previous is None else ErrorProfile.slot(previous))
+        self.errors.append(error)
+        self.latencies.append(latency)
+
+class ErrorProfileCache:
+    """Recently used ErrorProfiles kept in memory, written back when evicted or flushed"""
+    def __init__(self, capacity=256):
+        self.capacity = capacity
+        self.profiles = OrderedDict()  # path -> [ErrorProfile, dirty]
+        self.lock = threading.Lock()
+    
+    def peek(self, path):
+        """The cached profile for path, or None without touching the disk"""
+        with self.lock:
+            entry = self.profiles.get(path)
+            if entry is None:
+                return None
+            self.profiles.move_to_end(path)
+            return entry[0]
+    
+    def get(self, path):
+        """The profile for path, loading it on a miss"""
+        profile = self.peek(path)
+        if profile is not None:
+            return profile
+        profile = ErrorProfile.load(path)
+        with self.lock:
+            entry = self.profiles.setdefault(path, [profile, False])  # Another thread may have loaded it first
+            evicted = []
+            while len(self.profiles) > self.capacity:
+                evicted.append(self.profiles.popitem(last=False))
+        self.write_back(evicted)
+        return entry[0]
+    
+    def merge(self, path, session_errors):
+        """Add a session's typed characters to the profile for path; saved by the next flush"""
+        profile = self.get(path)
+        with self.lock:
+            profile.merge(session_errors)
+            if path in self.profiles:
+                self.profiles[path][1] = True
+            else:
+                self.write_back([(path, (profile, True))])  # Evicted while we merged
+        return profile
+    
+    def flush(self):
+        """Write every modified profile to disk"""
+        with self.lock:
+            dirty = [(path, (entry[0], True)) for path, entry in self.profiles.items() if entry[1]]
+            for entry in self.profiles.values():
+                entry[1] = False
+        self.write_back(dirty)
+    
+    @staticmethod
+    def write_back(entries):
+        for path, (profile, dirty) in entries:
+            if dirty:
+                try:
+                    profile.save(path)
+                except OSError as e:
+                    print(f"Error saving error profile {path}: {e}")
+
+class DifficultyPolicy:
+    """Rules for choosing the next difficulty level after a test"""
+    HYSTERESIS = 0.25  # How far past the halfway point a prediction must be to change level
+    
+    @staticmethod
+    def predicted_level(predicted_diff, store, current):
+        """Turn the model's prediction into a level, limiting jumps against the history in store"""
+        # Stay put unless the prediction is clearly closer to another level
+        if abs(predicted_diff - current) < 0.5 + DifficultyPolicy.HYSTERESIS:
+            return current
+        
+        # Clamp between 1 and 5
+        new_diff = min(5, max(1, int(round(predicted_diff))))
+        
+        # Apply some smoothing based on history
+        recent = store.recent
+        if store.session_count > 3 and len(recent) > 1:
+            last_diff = recent[-2]['difficulty']
+            if abs(new_diff - last_diff) > 1:  # Don't change too drastically
+                new_diff = last_diff + (1 if new_diff > last_diff else -1)
+        return new_diff
+    
+    @staticmethod
+    def fallback_level(current, wpm, accuracy):
+        """Step the level up or down by one when there is no model prediction"""
+        if accuracy > 95 and wpm > 50:
+            return min(5, current + 1)
+        if accuracy < 85 or wpm < 30:
+            return max(1, current - 1)
+        return current
+    
+    @staticmethod
+    def feedback(wpm, accuracy, reaction_time):
+        """Advice for a finished test, or None"""
+        if wpm < 30 and accuracy < 90:
+            return "Try to focus on accuracy first. Speed will come with practice!"
+        if wpm > 60 and accuracy > 95:
+            return "Great job! You're ready for more challenging texts."
+        if accuracy < 85:
+            return "Focus on typing accurately. Try to reduce errors."
+        if reaction_time > 0.5:
+            return "Your reaction time is a bit slow. Try to maintain a steady rhythm."
+        return None
+
+class TypingSession:
+    """UI-independent state and scoring of one typing test"""
+    # Keycodes differ between platforms, Tk's key symbols don't
+    MODIFIER_KEYSYMS = frozenset(["Shift_L", "Shift_R", "Control_L", "Control_R", "Alt_L", "Alt_R",
+                                  "Meta_L", "Meta_R", "Super_L", "Super_R", "Caps_Lock", "ISO_Level3_Shift"])
+    
+    def __init__(self, text, text_type, difficulty=2):
+        self.sample_text = text
+        self.text_type = text_type
+        self.difficulty = difficulty
+        self.comparator = IncrementalComparator(text)
+        self.metrics = LiveMetrics()
+        self.keystrokes = KeystrokeRecorder()
+        self.errors = SessionErrors()  # Characters typed in this test, merged into the profile at the end
+        self.running = False
+        self.completed = False
+        self.start_time = None
+        self.last_key_time = None
+        self.error_bursts = 0  # Times the input went from correct to wrong
+    
+    @property
+    def correct_chars(self):
+        return self.comparator.correct
+    
+    def key(self, now, keycode, char, input_text, position, keysym=None):
+        """Process one key press given the input after it; returns a metrics snapshot"""
+        if self.completed:
+            return None
+        
+        # Track reaction time (time between key presses)
+        modifier = keysym in self.MODIFIER_KEYSYMS
+        gap = 0.0
+        if self.last_key_time is not None and not modifier:
+            gap = now - self.last_key_time
+            self.metrics.record_gap(gap)
+        self.last_key_time = now
+        
+        started = False
+        if not self.running and not modifier:
+            self.running = True
+            self.start_time = now
+            self.metrics.start(now)
+            self.keystrokes.clear(now)
+            started = True
+        
+        on_track = self.comparator.is_prefix()
+        self.comparator.update(input_text)
+        self.metrics.update_text(len(input_text), len(input_text) - self.correct_chars)
+        if on_track and not self.comparator.is_prefix():
+            self.error_bursts += 1
+        
+        if self.running:
+            if char and char.isprintable() and 0 < position <= len(self.comparator.matches):
+                flag = self.comparator.matches[position - 1]
+                # Typed at the end rather than an edit further back, and not past the end of the sample
+                if position == len(input_text) and position <= len(self.sample_text):
+                    text = self.sample_text
+                    self.errors.record(text[position - 1], text[position - 2] if position > 1 else None,
+                                       not flag, gap)
+            else:
+                flag = -1  # No character typed
+            self.keystrokes.record(now, keycode, position, flag)
+        
+        accuracy = self.comparator.accuracy()
+        complete = self.comparator.is_complete()
+        if complete:
+            self.running = False
+            self.completed = True
+        return {
+            'started': started,
+            'accuracy': accuracy,
+            'reaction': self.metrics.reaction_mean(),
+            'progress': min(100, len(input_text) / len(self.sample_text) * 100),
+            'on_track': self.comparator.is_prefix(),
+            'complete': complete
+        }
+    
+    def tick(self, now):
+        """Smoothed speed and elapsed time for the live display"""
+        return {'wpm': self.metrics.tick(now), 'elapsed': self.metrics.elapsed(now)}
+    
+    def snapshot(self, now):
+        """Current unsmoothed metrics, for feedback while the test runs"""
+        return {
+            'wpm': self.metrics.net_wpm(now),
+            'accuracy': self.comparator.accuracy(),
+            'reaction': self.metrics.reaction_mean(),
+            'elapsed': self.metrics.elapsed(now)
+        }
+    
+    def results(self, now):
+        """Final scores of a completed test, in the session log's format"""
+        return {
+            'date': time.strftime("%Y-%m-%d %H:%M:%S"),
+            'wpm': self.metrics.net_wpm(now),
+            'gross_wpm': self.metrics.gross_wpm(now),
+            'accuracy': (self.correct_chars / len(self.sample_text)) * 100,
+            'difficulty': self.difficulty,
+            'text_type': self.text_type,
+            'elapsed_time': self.metrics.elapsed(now),
+            'avg_reaction_time': self.metrics.reaction_mean(),
+            **{f"reaction_p{p}": value for p, value in self.metrics.reactions.percentiles().items()},
+            'text_length': len(self.sample_text),
+            'error_bursts': self.error_bursts
+        }
+    
+    def record(self, store, now, keystroke_path):
+        """Save the keystroke log and append the results to store; returns the results"""
+        session_data = self.results(now)
+        # Keep the per-key timings and the reaction histogram out of the session log in their own files
         try:
-            with open('typing_stats.json', 'w') as f:
-                json.dump({'sessions': [], 'performance_history': [], 'user_level': 1}, f, indent=2)
-            messagebox.showinfo("Reset Stats", "All stats have been reset successfully!")
-            self.update_stats()
-        except Exception as e:
-            messagebox.showerror("Error", f"Failed to reset stats: {e}")
+            self.keystrokes.save(keystroke_path)
+            with open(self.reactions_path(keystroke_path), 'w') as f:
+                json.dump(self.metrics.reactions.to_dict(), f)
+            session_data['keystroke_log'] = keystroke_path
+        except OSError as e:
+            print(f"Error saving keystrokes: {e}")
+        store.append(session_data)
+        return session_data
+    
+    @staticmethod
+    def reactions_path(keystroke_path):
+        """Reaction time histogram saved beside a keystroke log"""
+        return os.path.splitext(keystroke_path)[0] + ".reactions.json"
 
 class TypeSpeedGUI(ttk.Frame):
     TEXT_SAMPLES = {
@@ -305,6 +2710,8 @@ class TypeSpeedGUI(ttk.Frame):
         4: 1.5,  # Expert - technical terms, complex sentences
         5: 2.0   # Challenge - very long words, specialized vocabulary
     }
+    
+    KEYSTROKE_DIR = "keystrokes"  # One binary keystroke log per completed session
 
     def __init__(self, parent, text_type, progress):
         super().__init__(parent)
@@ -314,16 +2721,12 @@ class TypeSpeedGUI(ttk.Frame):
         self.configure(style="TFrame")
         
         # Initialize performance tracking
-        self.reaction_times = deque(maxlen=10)  # Track last 10 reaction times
-        self.accuracy_history = deque(maxlen=10)  # Track last 10 accuracy values
+        self.session = None  # TypingSession for the text on screen
         self.current_difficulty = 2  # Start with normal difficulty
         self.session_count = 0
         
-        # Load or create neural network model
-        self.model = self.load_or_create_model()
-        
-        # Load or initialize stats
-        self.stats = self.load_stats()
+        # Session history shared with the other pages
+        self.session_store = self.controller.session_store
         
         # UI Elements
         self.create_ui()
@@ -331,19 +2734,8 @@ class TypeSpeedGUI(ttk.Frame):
         # AI Feedback timer
         self.ai_feedback_timer = None
         self.last_feedback_time = 0
-        
-        self.running = False
-        self.completed = False
-        self.start_time = None
-        self.last_key_time = None
-        self.correct_chars = 0
-        self.total_chars = 0
     
     def create_ui(self):
-        # Define custom styles for LabelFrames
-        self.controller.style.configure("Custom.TLabelframe", background="#ffffff")
-        self.controller.style.configure("Custom.TLabelframe.Label", foreground="#000000", font=("Helvetica", 12, "bold"))
-        
         # Difficulty and feedback labels
         self.difficulty_frame = ttk.Frame(self)
         self.difficulty_frame.pack(fill="x", pady=5)
@@ -378,7 +2770,7 @@ class TypeSpeedGUI(ttk.Frame):
                                      pady=10,
                                      borderwidth=1)
         self.sample_label.pack(fill="x", anchor="center")  # Centered
-        self.sample_label.config(text=self.select_text_based_on_difficulty())
+        self.set_sample_text(self.select_text_based_on_difficulty())
         
         # Input area
         self.input_frame = ttk.Frame(self)
@@ -460,6 +2852,13 @@ class TypeSpeedGUI(ttk.Frame):
                                        background="#ffffff")  # White background
         self.reaction_label.pack(anchor="center")  # Centered
         
+        # Metric labels are only updated from the Tk thread through this scheduler
+        self.ui_updates = UIRefreshScheduler(self)
+        self.ui_updates.bind("wpm", self.wpm_label)
+        self.ui_updates.bind("accuracy", self.accuracy_label)
+        self.ui_updates.bind("time", self.time_label)
+        self.ui_updates.bind("reaction", self.reaction_label)
+        
         tk.Label(self.reaction_frame, 
                  text="Avg. Reaction Time", 
                  font=("Helvetica", 10),
@@ -475,208 +2874,75 @@ class TypeSpeedGUI(ttk.Frame):
                                        command=self.reset)
         self.reset_button.pack(side="left", padx=5, anchor="center")  # Centered
     
-    def load_text_samples(self, text_type):
-        """Load text samples and preprocess them for difficulty levels"""
-        base_texts = self.TEXT_SAMPLES[text_type]
-        enhanced_texts = []
-        
-        # Create multiple difficulty versions of each text
-        for text in base_texts:
-            words = text.split()
-            for diff_level in range(1, 6):
-                # Adjust text based on difficulty level
-                modified_words = []
-                for word in words:
-                    if diff_level >= 4 and len(word) < 5 and random.random() > 0.7:
-                        # For higher difficulties, sometimes replace short words with longer ones
-                        modified_words.append(self.get_complex_word())
-                    else:
-                        modified_words.append(word)
-                
-                # For highest difficulty, make sentences more complex
-                if diff_level == 5:
-                    modified_text = " ".join(modified_words)
-                    if not any(p in modified_text for p in [",", ";", ":"]):
-                        parts = modified_text.split(". ")
-                        if len(parts) > 1:
-                            modified_text = ", ".join(parts[:-1]) + "; " + parts[-1]
-                    enhanced_texts.append(modified_text)
-                else:
-                    enhanced_texts.append(" ".join(modified_words))
-        
-        return enhanced_texts
-    
-    def get_complex_word(self):
-        """Get a more complex word from a predefined list"""
-        complex_words = [
-            "algorithm", "binary", "compiler", "debugging", "encapsulation",
-            "framework", "inheritance", "javascript", "kernel", "lambda",
-            "multithreading", "namespace", "object", "polymorphism", "query",
-            "recursion", "syntax", "template", "utility", "variable"
-        ]
-        return random.choice(complex_words)
-    
-    def load_or_create_model(self):
-        """Load existing model or create a new one"""
-        try:
-            if os.path.exists('typing_model.keras'):
-                # Load the model
-                model = tf.keras.models.load_model('typing_model.keras')
-                print("Loaded existing model")
-                
-                # Recompile the model to reset the optimizer
-                model.compile(optimizer='adam', loss=tf.keras.losses.MeanSquaredError())
-            else:
-                model = self.create_new_model()
-                print("Created new model")
-            return model
-        except Exception as e:
-            print(f"Error loading/creating model: {e}")
-            return self.create_new_model()
-
-    def create_new_model(self):
-        """Create a new neural network model"""
-        model = tf.keras.Sequential([
-            tf.keras.layers.Input(shape=(3,)),  # Explicitly define the input shape
-            tf.keras.layers.Dense(16, activation='relu'),
-            tf.keras.layers.Dense(8, activation='relu'),
-            tf.keras.layers.Dense(1, activation='linear')
-        ])
-        model.compile(optimizer='adam', loss=tf.keras.losses.MeanSquaredError())  # Use the class explicitly
-        return model
-    
-    def load_stats(self):
-        """Load or initialize statistics"""
-        try:
-            if os.path.exists('typing_stats.json'):
-                with open('typing_stats.json', 'r') as f:
-                    return json.load(f)
-        except:
-            pass
-        
-        # Return default stats if file doesn't exist or error
-        return {
-            'sessions': [],
-            'performance_history': [],
-            'user_level': 1
-        }
-    
-    def save_stats(self):
-        """Save statistics to file"""
-        try:
-            with open('typing_stats.json', 'w') as f:
-                json.dump(self.stats, f, indent=2)
-        except Exception as e:
-            print(f"Error saving stats: {e}")
+    def set_sample_text(self, text):
+        """Show a new sample text and start a fresh session for it"""
+        self.sample_label.config(text=text)
+        self.session = TypingSession(text, self.text_type, self.current_difficulty)
     
     def select_text_based_on_difficulty(self):
         """Select text based on current difficulty level"""
-        # Filter texts that match current difficulty profile
-        suitable_texts = []
-        for text in self.TEXT_SAMPLES[self.text_type]:
-            avg_word_len = sum(len(word) for word in text.split()) / len(text.split())
-            complexity = avg_word_len * len([c for c in text if c in ',;:'])
-            
-            # Simple heuristic to match text to difficulty level
-            text_diff = min(5, max(1, int(complexity / 5 + 1)))
-            
-            if text_diff == self.current_difficulty:
-                suitable_texts.append(text)
-        
-        if suitable_texts:
-            return random.choice(suitable_texts)
-        return random.choice(self.TEXT_SAMPLES[self.text_type])  # Fallback
+        return self.controller.corpus.select(self.text_type, self.current_difficulty, self.controller.error_profile)
     
     def start(self, event):
-        if self.completed:
+        session = self.session
+        position = self.input_entry.index(tk.INSERT)
+        snapshot = session.key(time.time(), event.keycode, event.char, self.input_entry.get(), position, event.keysym)
+        if snapshot is None:
             return
-
-        # Track reaction time (time between key presses)
-        current_time = time.time()
-        if self.last_key_time is not None and event.keycode not in [16, 17, 18]:  # Ignore modifier keys
-            reaction_time = current_time - self.last_key_time
-            self.reaction_times.append(reaction_time)
-            self.reaction_label.config(text=f"{np.mean(self.reaction_times):.2f}s" if self.reaction_times else "0.00s")
-        self.last_key_time = current_time
-
-        if not self.running:
-            if event.keycode not in [16, 17, 18]:  # Ignore Shift, Ctrl, Alt keys
-                self.running = True
-                self.start_time = time.time()
-                self.thread = threading.Thread(target=self.time_thread, daemon=True)
-                self.thread.start()
-                self.schedule_ai_feedback()
-
-        # Calculate accuracy
-        sample_text = self.sample_label.cget("text")
-        input_text = self.input_entry.get()
-        self.total_chars = len(sample_text)
-        
-        correct = 0
-        for i, (s, t) in enumerate(zip(sample_text, input_text)):
-            if s == t:
-                correct += 1
-        self.correct_chars = correct
-        
-        accuracy = (correct / len(input_text)) * 100 if input_text else 0
-        self.accuracy_history.append(accuracy)
-        self.accuracy_label.config(text=f"{accuracy:.1f}%")
-
-        # Update progress
-        progress = (len(input_text) / len(sample_text)) * 100
-        progress = min(progress, 100)  # Clamp progress to 100%
-        self.progress["value"] = progress
-
+        
+        if snapshot['started']:
+            self.thread = threading.Thread(target=self.time_thread, args=(session,), daemon=True)
+            self.thread.start()
+            self.schedule_ai_feedback()
+        
+        self.ui_updates.set("reaction", f"{snapshot['reaction']:.2f}s")
+        self.ui_updates.set("accuracy", f"{snapshot['accuracy']:.1f}%")
+        self.progress["value"] = snapshot['progress']
+        
         # Visual feedback
-        if not sample_text.startswith(input_text):
-            self.input_entry.config(fg="red")
-        else:
-            self.input_entry.config(fg="black")
-
+        self.input_entry.config(fg="black" if snapshot['on_track'] else "red")
+        
         # Check for completion
-        if input_text == sample_text:
+        if snapshot['complete']:
             self.complete_test()
     
     def complete_test(self):
         """Handle test completion"""
-        self.running = False
-        self.completed = True
         self.input_entry.config(fg="green")
         self.input_entry.config(state="readonly")
         
-        # Calculate final stats
-        elapsed_time = time.time() - self.start_time
-        wps = len(self.input_entry.get().split()) / elapsed_time
-        wpm = wps * 60
-        accuracy = (self.correct_chars / self.total_chars) * 100
-        
-        # Update session stats
-        session_data = {
-            'date': time.strftime("%Y-%m-%d %H:%M:%S"),
-            'wpm': wpm,
-            'accuracy': accuracy,
-            'difficulty': self.current_difficulty,
-            'text_type': self.text_type,
-            'elapsed_time': elapsed_time,
-            'avg_reaction_time': np.mean(self.reaction_times) if self.reaction_times else 0
-        }
-        
-        self.stats['sessions'].append(session_data)
-        self.stats['performance_history'].append({
-            'wpm': wpm,
-            'accuracy': accuracy,
-            'reaction_time': session_data['avg_reaction_time'],
-            'difficulty': self.current_difficulty
-        })
-        
-        # Save stats
-        self.save_stats()
-        
-        # Update AI model with this session's data
-        self.update_ai_model(wpm, accuracy, np.mean(self.reaction_times) if self.reaction_times else 0)
-        
+        # Score the session and save it with its keystroke log
+        keystroke_path = os.path.join(self.KEYSTROKE_DIR, time.strftime("%Y%m%d-%H%M%S") + f"-{self.text_type}.bin")
+        log_start = self.session_store.index.log_size
+        session_data = self.session.record(self.session_store, time.time(), keystroke_path)
+        wpm = session_data['wpm']
+        accuracy = session_data['accuracy']
+        try:
+            self.controller.error_profile.merge(self.session.errors)
+            self.controller.error_profile.save(ErrorProfile.path_for(self.session_store))
+        except OSError as e:
+            print(f"Error saving error profile: {e}")
+        self.controller.events.publish("session_completed", session=session_data, log_start=log_start,
+                                       log_end=self.session_store.index.log_size)
+        
+        # Predict the next difficulty and train the shared model off the Tk thread
+        reaction_time = session_data['avg_reaction_time']
+        history = self.session_store.recent
+        future = self.controller.model_service.predict(history)
+        self.controller.model_service.add_sample(history)
+        self.wait_for_model(future, lambda: self.finish_test(wpm, accuracy, reaction_time, future))
+    
+    def wait_for_model(self, future, callback):
+        """Poll a model future from the Tk thread and run callback once it is done"""
+        if future.done():
+            callback()
+        else:
+            self.after(10, self.wait_for_model, future, callback)
+    
+    def finish_test(self, wpm, accuracy, reaction_time, future):
+        """Apply the model's prediction and report the results"""
         # Determine next difficulty level
-        self.adjust_difficulty(wpm, accuracy, session_data['avg_reaction_time'])
+        self.adjust_difficulty(wpm, accuracy, reaction_time, future)
         
         # Show completion message with stats
         messagebox.showinfo("Test Complete", 
@@ -686,56 +2952,22 @@ class TypeSpeedGUI(ttk.Frame):
                            f"Difficulty: {self.current_difficulty}/5\n\n"
                            f"Next test will be at difficulty level {self.current_difficulty}")
     
-    def update_ai_model(self, wpm, accuracy, reaction_time):
-        """Update the AI model with new training data"""
-        try:
-            # Prepare data
-            X = np.array([[wpm, accuracy, reaction_time]])
-            y = np.array([[self.current_difficulty]])
-            
-            # Train the model with this single example
-            self.model.fit(X, y, epochs=1, verbose=0)
-            
-            # Save the updated model in the recommended format
-            self.model.save('typing_model.keras')  # Use .keras format
-        except Exception as e:
-            print(f"Error updating model: {e}")
-    
-    def adjust_difficulty(self, wpm, accuracy, reaction_time):
+    def adjust_difficulty(self, wpm, accuracy, reaction_time, future):
         """Adjust difficulty based on performance"""
         try:
-            # Use the model to predict appropriate difficulty
-            input_data = np.array([[wpm, accuracy, reaction_time]])
-            predicted_diff = self.model.predict(input_data)[0][0]
-            
-            # Clamp between 1 and 5
-            new_diff = min(5, max(1, int(round(predicted_diff))))
-            
-            # Apply some smoothing based on history
-            if len(self.stats['sessions']) > 3:
-                last_diff = self.stats['sessions'][-2]['difficulty']
-                if abs(new_diff - last_diff) > 1:  # Don't change too drastically
-                    new_diff = last_diff + (1 if new_diff > last_diff else -1)
-            
-            self.current_difficulty = new_diff
+            # Use the model's prediction of the appropriate difficulty
+            self.current_difficulty = DifficultyPolicy.predicted_level(future.result(), self.session_store,
+                                                                       self.current_difficulty)
             self.difficulty_label.config(text=f"Difficulty Level: {self.current_difficulty}/5")
             
             # Provide feedback based on performance
-            if wpm < 30 and accuracy < 90:
-                self.show_ai_feedback("Try to focus on accuracy first. Speed will come with practice!")
-            elif wpm > 60 and accuracy > 95:
-                self.show_ai_feedback("Great job! You're ready for more challenging texts.")
-            elif accuracy < 85:
-                self.show_ai_feedback("Focus on typing accurately. Try to reduce errors.")
-            elif reaction_time > 0.5:
-                self.show_ai_feedback("Your reaction time is a bit slow. Try to maintain a steady rhythm.")
+            feedback = DifficultyPolicy.feedback(wpm, accuracy, reaction_time)
+            if feedback:
+                self.show_ai_feedback(feedback)
         except Exception as e:
             print(f"Error adjusting difficulty: {e}")
             # Fallback rules if model fails
-            if accuracy > 95 and wpm > 50:
-                self.current_difficulty = min(5, self.current_difficulty + 1)
-            elif accuracy < 85 or wpm < 30:
-                self.current_difficulty = max(1, self.current_difficulty - 1)
+            self.current_difficulty = DifficultyPolicy.fallback_level(self.current_difficulty, wpm, accuracy)
             self.difficulty_label.config(text=f"Difficulty Level: {self.current_difficulty}/5")
     
     def schedule_ai_feedback(self):
@@ -748,7 +2980,7 @@ class TypeSpeedGUI(ttk.Frame):
     
     def provide_ai_feedback(self):
         """Provide real-time feedback during the test"""
-        if not self.running or self.completed:
+        if not self.session.running:
             return
         
         current_time = time.time()
@@ -756,18 +2988,14 @@ class TypeSpeedGUI(ttk.Frame):
             self.schedule_ai_feedback()
             return
         
-        elapsed = time.time() - self.start_time
-        if elapsed < 5:  # Don't give feedback in first 5 seconds
+        # Calculate current metrics
+        snapshot = self.session.snapshot(current_time)
+        if snapshot['elapsed'] < 5:  # Don't give feedback in first 5 seconds
             self.schedule_ai_feedback()
             return
-        
-        # Calculate current metrics
-        input_text = self.input_entry.get()
-        sample_text = self.sample_label.cget("text")
-        accuracy = (self.correct_chars / len(input_text)) * 100 if input_text else 0
-        wps = len(input_text.split()) / elapsed
-        wpm = wps * 60
-        avg_reaction = np.mean(self.reaction_times) if self.reaction_times else 0
+        accuracy = snapshot['accuracy']
+        wpm = snapshot['wpm']
+        avg_reaction = snapshot['reaction']
         
         # Generate feedback
         feedback = ""
@@ -791,52 +3019,510 @@ class TypeSpeedGUI(ttk.Frame):
         self.feedback_label.config(text=f"AI Feedback: {message}", fg="blue")
         self.feedback_label.after(100, lambda: self.feedback_label.config(fg="dark blue"))
     
-    def time_thread(self):
-        while self.running:
+    def time_thread(self, session):
+        """Produce live speed/time snapshots; never touches widgets directly"""
+        generation = self.ui_updates.generation
+        while session.running and generation == self.ui_updates.generation:
             time.sleep(0.1)
-            if self.start_time is None:  # Ensure start_time is initialized
-                continue
-            elapsed_time = time.time() - self.start_time
-            if elapsed_time > 0:
-                wps = len(self.input_entry.get().split()) / elapsed_time
-                wpm = wps * 60
-            else:
-                wps = 0
-                wpm = 0
-            self.wpm_label.config(text=f"{wpm:.1f}")
-            self.time_label.config(text=f"{elapsed_time:.1f}s")
+            snapshot = session.tick(time.time())
+            self.ui_updates.push(generation, wpm=f"{snapshot['wpm']:.1f}", time=f"{snapshot['elapsed']:.1f}s")
     
     def reset(self):
-        self.running = False
-        self.completed = False
-        self.start_time = None
-        self.last_key_time = None
         self.input_entry.config(state="normal")
         self.input_entry.delete(0, tk.END)
         self.input_entry.config(fg="black")
         self.input_entry.focus_set()
         
         # Select a new sample text based on current difficulty
-        self.sample_label.config(text=self.select_text_based_on_difficulty())
+        self.set_sample_text(self.select_text_based_on_difficulty())
         
         # Reset stats displays
-        self.wpm_label.config(text="0.00")
-        self.accuracy_label.config(text="100%")
-        self.time_label.config(text="0.00s")
-        self.reaction_label.config(text="0.00s")
+        self.ui_updates.reset()
+        self.ui_updates.set("wpm", "0.00")
+        self.ui_updates.set("accuracy", "100%")
+        self.ui_updates.set("time", "0.00s")
+        self.ui_updates.set("reaction", "0.00s")
         self.progress["value"] = 0
         
-        # Reset tracking variables
-        self.correct_chars = 0
-        self.total_chars = 0
-        self.reaction_times.clear()
-        self.accuracy_history.clear()
-        
         # Cancel any pending feedback
         if self.ai_feedback_timer is not None:
             self.after_cancel(self.ai_feedback_timer)
             self.ai_feedback_timer = None
 
+class TypingServer:
+    """Run typing tests for many users at once over a local socket, one JSON object per line.
+    
+    Requests (all but metrics carry "user"):
+      {"op": "start", "text_type": "short"}          -> text and difficulty
+      {"op": "key", "input": "...", "keycode": 65, "keysym": "a", "char": "a", "position": 1, "time": t}
+                                                      -> live metrics, plus results once complete
+      {"op": "status"}                                -> smoothed WPM and elapsed time
+      {"op": "stats"}                                 -> the user's stats summary
+      {"op": "metrics"}                               -> model batching counters
+    "time" and "keysym" are optional.
+    """
+    USER_PATTERN = re.compile(r"\w[\w.-]{0,63}", re.ASCII)
+    DATA_DIR = "typing_users"
+    FIELD_TYPES = {'op': str, 'text_type': str, 'input': str, 'keycode': int, 'keysym': (str, type(None)),
+                   'char': str, 'position': int, 'time': (int, float)}
+    
+    PROFILE_FLUSH_INTERVAL = 30  # Seconds between writing back modified error profiles
+    
+    def __init__(self, corpus, directory, model_service=None, model_capacity=256):
+        self.corpus = corpus
+        self.directory = directory
+        self.model_service = model_service
+        self.models = None if model_service is None else ModelRegistry(model_service, os.path.join(directory, "models"),
+                                                                       model_capacity)
+        self.keystroke_dir = os.path.join(directory, TypeSpeedGUI.KEYSTROKE_DIR)
+        os.makedirs(self.keystroke_dir, exist_ok=True)
+        self.store_capacity = model_capacity
+        self.stores = OrderedDict()  # user -> SessionStore, least recently used first
+        self.profiles = ErrorProfileCache(model_capacity)
+        self.sessions = {}  # user -> TypingSession in progress
+        self.saving = {}    # user -> finished tests still being written
+        self.levels = {}    # user -> {text_type: difficulty of the next test}, dropped with the store
+    
+    def log_path(self, user):
+        return os.path.join(self.directory, user + ".jsonl")
+    
+    def store(self, user):
+        if user not in self.stores:
+            self.stores[user] = SessionStore(self.log_path(user), os.path.join(self.directory, user + ".index.json"))
+        self.stores.move_to_end(user)
+        self.evict_stores()
+        return self.stores[user]
+    
+    async def open_store(self, user):
+        """The user's store, opened off the event loop the first time since it reads and writes files"""
+        if user not in self.stores:
+            store = await asyncio.to_thread(SessionStore, self.log_path(user),
+                                            os.path.join(self.directory, user + ".index.json"))
+            self.stores.setdefault(user, store)
+        return self.store(user)
+    
+    def evict_stores(self):
+        """Forget the least recently used stores past capacity, except the latest and those of users mid-test"""
+        for user in list(self.stores)[:-1]:
+            if len(self.stores) <= self.store_capacity:
+                break
+            if user not in self.sessions and user not in self.saving:
+                del self.stores[user]
+                self.levels.pop(user, None)  # Resumes from the log next time
+    
+    def level(self, user, text_type):
+        """Difficulty of the user's next test, resuming from their last one of this type"""
+        levels = self.levels.setdefault(user, {})
+        if text_type not in levels:
+            levels[text_type] = next((session['difficulty'] for session in reversed(self.store(user).recent)
+                                      if session.get('text_type') == text_type), 2)
+        return levels[text_type]
+    
+    async def handle(self, reader, writer):
+        """Serve one connection until the client closes it"""
+        started = {}  # user -> session started on this connection, abandoned if it closes first
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    request = json.loads(line)
+                    response = await self.dispatch(request)
+                    if response['ok'] and request.get('op') == 'start':
+                        started[request['user']] = self.sessions[request['user']]
+                except KeyError as e:
+                    response = {'ok': False, 'error': f"missing {e}"}
+                except (ValueError, TypeError) as e:
+                    response = {'ok': False, 'error': str(e)}
+                except Exception as e:
+                    print(f"Error handling request: {e!r}")
+                    response = {'ok': False, 'error': "Internal error"}
+                writer.write((json.dumps(response) + "\n").encode())
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            for user, session in started.items():
+                if self.sessions.get(user) is session:
+                    del self.sessions[user]
+            writer.close()
+    
+    async def dispatch(self, request):
+        if not isinstance(request, dict):
+            raise ValueError("Request must be a JSON object")
+        for name, types in self.FIELD_TYPES.items():
+            value = request.get(name)
+            if name in request and (not isinstance(value, types) or isinstance(value, bool)):
+                raise TypeError(f"Invalid {name}: {value!r}")
+        if request.get('op') == 'metrics':
+            if self.model_service is None:
+                return {'ok': True, 'batching': None}
+            return {'ok': True, 'batching': self.model_service.batcher.stats(),
+                    'personal_batching': self.models.batcher.stats()}
+        user = request['user']
+        if not isinstance(user, str) or not self.USER_PATTERN.fullmatch(user):
+            raise ValueError(f"Invalid user name: {user!r}")
+        op = request['op']
+        if op == 'stats' and user not in self.stores and not os.path.exists(self.log_path(user)):
+            return {'ok': True, 'stats': StatsIndex().summary()}  # Don't create files for a stranger
+        if op in ('start', 'stats'):
+            await self.open_store(user)
+        
+        if op == 'start':
+            text_type = request['text_type']
+            if text_type not in TypeSpeedGUI.TEXT_SAMPLES:
+                raise ValueError(f"Unknown text type: {text_type!r}")
+            difficulty = self.level(user, text_type)
+            path = ErrorProfile.path_for(self.store(user))
+            profile = self.profiles.peek(path) or await asyncio.to_thread(self.profiles.get, path)
+            text = self.corpus.select(text_type, difficulty, profile)
+            self.sessions[user] = TypingSession(text, text_type, difficulty)
+            return {'ok': True, 'text': text, 'difficulty': difficulty}
+        
+        session = self.sessions.get(user)
+        if op == 'stats':
+            return {'ok': True, 'stats': self.store(user).index.summary()}
+        if session is None:
+            return {'ok': False, 'error': "No test in progress"}
+        if op == 'status':
+            return {'ok': True, **session.tick(time.time())}
+        if op != 'key':
+            raise ValueError(f"Unknown op: {op!r}")
+        
+        input_text = request['input']
+        now = request.get('time', time.time())
+        snapshot = session.key(now, request.get('keycode', 0), request.get('char', ""),
+                               input_text, request.get('position', len(input_text)), request.get('keysym'))
+        response = {'ok': True, **snapshot}
+        if snapshot['complete']:
+            response['results'] = await self.complete(user, session, now)
+        return response
+    
+    async def complete(self, user, session, now):
+        """Save a finished test and pick the user's next difficulty"""
+        del self.sessions[user]
+        store = self.store(user)
+        keystroke_path = os.path.join(self.keystroke_dir, f"{user}-{store.session_count}-{session.text_type}.bin")
+        # The log, index and keystroke writes fsync, so they run off the event loop
+        self.saving[user] = self.saving.get(user, 0) + 1  # Keeps the store from being evicted meanwhile
+        try:
+            session_data, history = await asyncio.to_thread(self.save_session, store, session, now, keystroke_path)
+        finally:
+            self.saving[user] -= 1
+            if not self.saving[user]:
+                del self.saving[user]
+        wpm = session_data['wpm']
+        accuracy = session_data['accuracy']
+        reaction_time = session_data['avg_reaction_time']
+        
+        try:
+            if self.model_service is None:
+                raise FileNotFoundError("No difficulty model")
+            # Loading a user's model on a cache miss reads it from disk
+            future = await asyncio.to_thread(self.models.predict, user, history)
+            predicted = await asyncio.wrap_future(future)
+            level = DifficultyPolicy.predicted_level(predicted, store, session.difficulty)
+        except Exception:
+            level = DifficultyPolicy.fallback_level(session.difficulty, wpm, accuracy)
+        if self.models is not None:
+            await asyncio.to_thread(self.models.add_sample, user, history)
+        self.levels.setdefault(user, {})[session.text_type] = level
+        return {**session_data, 'next_difficulty': level,
+                'feedback': DifficultyPolicy.feedback(wpm, accuracy, reaction_time)}
+    
+    def save_session(self, store, session, now, keystroke_path):
+        """Write a finished test to disk; returns its results and a copy of the user's history"""
+        session_data = session.record(store, now, keystroke_path)
+        self.profiles.merge(ErrorProfile.path_for(store), session.errors)
+        with store.lock:
+            return session_data, list(store.recent)
+    
+    async def serve(self, host, port):
+        if self.model_service is not None:
+            # Importing TensorFlow holds the GIL for seconds; do it before there are requests to stall
+            await asyncio.to_thread(self.model_service.get_model)
+        server = await asyncio.start_server(self.handle, host, port, limit=1 << 20)
+        print(f"Serving typing tests on {host}:{port}")
+        flusher = asyncio.create_task(self.flush_profiles())
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            flusher.cancel()
+    
+    async def flush_profiles(self):
+        while True:
+            await asyncio.sleep(self.PROFILE_FLUSH_INTERVAL)
+            await asyncio.to_thread(self.profiles.flush)
+    
+    def shutdown(self):
+        self.profiles.flush()
+        if self.models is not None:
+            self.models.shutdown()
+
+def record_keystroke_stream(text, error_rate=0.05, edit_rate=0.01, seed=0):
+    """Simulate typing text and return the entry contents after every keystroke"""
+    rng = random.Random(seed)
+    stream = []
+    typed = ""
+    for char in text:
+        if rng.random() < error_rate:
+            # Mistype, then backspace over it
+            stream.append(typed + rng.choice("abcdefghijklmnopqrstuvwxyz"))
+            stream.append(typed)
+        if typed and rng.random() < edit_rate:
+            # Click back into the text, delete a character and retype it
+            pos = rng.randrange(len(typed))
+            stream.append(typed[:pos] + typed[pos + 1:])
+            stream.append(typed)
+        typed += char
+        stream.append(typed)
+    return stream
+
+def full_scan_accuracy(sample_text, input_text):
+    """The original per-keystroke accuracy check, kept as the benchmark baseline"""
+    correct = 0
+    for s, t in zip(sample_text, input_text):
+        if s == t:
+            correct += 1
+    return correct, sample_text.startswith(input_text), input_text == sample_text
+
+def benchmark_accuracy_tracking(repeat=20):
+    """Replay a keystroke stream through the full-scan and incremental checks"""
+    text = max((t for texts in TypeSpeedGUI.TEXT_SAMPLES.values() for t in texts), key=len)
+    stream = record_keystroke_stream(text)
+    
+    begin = time.perf_counter()
+    for _ in range(repeat):
+        expected = [full_scan_accuracy(text, typed) for typed in stream]
+    full_scan = (time.perf_counter() - begin) / (repeat * len(stream))
+    
+    begin = time.perf_counter()
+    for _ in range(repeat):
+        comparator = IncrementalComparator(text)
+        actual = []
+        for typed in stream:
+            comparator.update(typed)
+            actual.append((comparator.correct, comparator.is_prefix(), comparator.is_complete()))
+    incremental = (time.perf_counter() - begin) / (repeat * len(stream))
+    
+    if actual != expected:
+        raise AssertionError("Incremental accuracy tracking disagrees with the full scan")
+    print(f"Replayed {len(stream)} keystrokes over a {len(text)} character text")
+    print(f"Full scan:   {full_scan * 1e6:8.2f} us per keystroke")
+    print(f"Incremental: {incremental * 1e6:8.2f} us per keystroke ({full_scan / incremental:.1f}x faster)")
+
+def synthetic_keystrokes(text, wpm=60, error_rate=0.03, backspace_rate=0.01, seed=0):
+    """Simulate a typist and return (delay, keycode, char, entry text, cursor) per key press"""
+    rng = random.Random(seed)
+    mean_gap = 60.0 / (wpm * LiveMetrics.CHARS_PER_WORD)
+    events = []
+    typed = ""
+    
+    def press(char):
+        keycode = 8 if char == "\b" else ord(char.upper())  # Windows virtual key codes
+        delay = rng.gammavariate(4.0, mean_gap / 4.0)
+        events.append((delay, keycode, "" if char == "\b" else char, typed, len(typed)))
+    
+    for char in text:
+        if rng.random() < error_rate:
+            typed += rng.choice("abcdefghijklmnopqrstuvwxyz")
+            press(typed[-1])
+            typed = typed[:-1]
+            press("\b")
+        if typed and rng.random() < backspace_rate:
+            removed = typed[-1]
+            typed = typed[:-1]
+            press("\b")
+            typed += removed
+            press(removed)
+        typed += char
+        press(char)
+    return events
+
+def benchmark_sessions(wpm=60, error_rate=0.03, backspace_rate=0.01, runs=10, seed=0):
+    """Report key handler and completion latency percentiles per text length"""
+    print(f"Simulated typist: {wpm} WPM, {error_rate:.0%} errors, {backspace_rate:.0%} extra backspaces, {runs} runs per text")
+    print(f"{'text':<8}{'keys':>7}{'key p50':>10}{'key p90':>10}{'key p99':>10}{'done p50':>11}{'done p99':>11}{'net wpm':>9}")
+    with tempfile.TemporaryDirectory() as directory:
+        store = SessionStore(os.path.join(directory, "sessions.jsonl"), os.path.join(directory, "index.json"))
+        for text_type, texts in TypeSpeedGUI.TEXT_SAMPLES.items():
+            key_times = []
+            done_times = []
+            results = []
+            for run in range(runs):
+                for number, text in enumerate(texts):
+                    events = synthetic_keystrokes(text, wpm, error_rate, backspace_rate, seed=seed + run * 1000 + number)
+                    session = TypingSession(text, text_type)
+                    now = 0.0
+                    for delay, keycode, char, typed, position in events:
+                        now += delay
+                        begin = time.perf_counter()
+                        session.key(now, keycode, char, typed, position)
+                        key_times.append(time.perf_counter() - begin)
+                    if not session.completed:
+                        raise AssertionError("Synthetic keystroke stream did not finish the text")
+                    if run == 0:
+                        # A typo left in place lets the input run past the end of the sample
+                        overshoot = TypingSession(text, text_type)
+                        typed = "~" + text[1:] + "~~"
+                        for position in range(1, len(typed) + 1):
+                            overshoot.key(position * 0.2, 0, typed[position - 1], typed[:position], position)
+                        if overshoot.completed:
+                            raise AssertionError("Input with a typo completed the text")
+                    begin = time.perf_counter()
+                    keystroke_path = os.path.join(directory, f"{store.session_count}-{text_type}.bin")
+                    results.append(session.record(store, now, keystroke_path))
+                    store.index.summary()  # What the stats page reads next
+                    done_times.append(time.perf_counter() - begin)
+            key_us = np.percentile(key_times, [50, 90, 99]) * 1e6
+            done_ms = np.percentile(done_times, [50, 99]) * 1e3
+            net_wpm = np.mean([result['wpm'] for result in results])
+            print(f"{text_type:<8}{len(key_times) // len(results):>7}"
+                  f"{key_us[0]:>8.1f}us{key_us[1]:>8.1f}us{key_us[2]:>8.1f}us"
+                  f"{done_ms[0]:>9.2f}ms{done_ms[1]:>9.2f}ms{net_wpm:>9.1f}")
+
+async def load_test_user(host, port, user, text_type, wpm, error_rate, backspace_rate, latencies, seed=0):
+    """Type one synthetic test against the server in real time; returns the results"""
+    reader, writer = await asyncio.open_connection(host, port, limit=1 << 20)
+    
+    async def request(**message):
+        begin = time.perf_counter()
+        writer.write((json.dumps({'user': user, **message}) + "\n").encode())
+        await writer.drain()
+        response = json.loads(await reader.readline())
+        # Starts and completions wait for disk and the model, so each kind is reported on its own
+        kind = 'complete' if 'results' in response else message['op']
+        latencies[kind].append(time.perf_counter() - begin)
+        if not response['ok']:
+            raise RuntimeError(response['error'])
+        return response
+    
+    try:
+        text = (await request(op='start', text_type=text_type))['text']
+        now = time.time()
+        response = None
+        for delay, keycode, char, typed, position in synthetic_keystrokes(text, wpm, error_rate, backspace_rate,
+                                                                          seed=seed):
+            await asyncio.sleep(delay)
+            now += delay
+            response = await request(op='key', input=typed, keycode=keycode, char=char, position=position, time=now)
+        return response['results']
+    finally:
+        writer.close()
+
+def run_load_test(host, port, users, text_type="short", wpm=60, error_rate=0.03, backspace_rate=0.01):
+    """Run one test per simulated user concurrently and report request latencies"""
+    async def main():
+        latencies = {'start': [], 'key': [], 'complete': []}
+        begin = time.perf_counter()
+        outcomes = await asyncio.gather(*(load_test_user(host, port, f"loadtest-{number}", text_type, wpm,
+                                                         error_rate, backspace_rate, latencies, number)
+                                          for number in range(users)), return_exceptions=True)
+        return outcomes, latencies, time.perf_counter() - begin
+    
+    outcomes, latencies, elapsed = asyncio.run(main())
+    failures = [outcome for outcome in outcomes if isinstance(outcome, BaseException)]
+    for failure in failures[:5]:
+        print(f"Error in load test session: {failure!r}")
+    results = [outcome for outcome in outcomes if not isinstance(outcome, BaseException)]
+    print(f"{len(results)}/{users} {text_type} tests completed in {elapsed:.1f}s, "
+          f"{sum(map(len, latencies.values())) / elapsed:.0f} requests/s")
+    for kind, kind_latencies in latencies.items():
+        if kind_latencies:
+            p50, p90, p99 = np.percentile(kind_latencies, [50, 90, 99]) * 1e3
+            print(f"{kind.capitalize()} latency: p50 {p50:.2f}ms, p90 {p90:.2f}ms, p99 {p99:.2f}ms")
+    if results:
+        print(f"Mean net speed: {np.mean([result['wpm'] for result in results]):.1f} WPM")
+    return not failures
+
 if __name__ == "__main__":
-    app = MainPage()
+    parser = argparse.ArgumentParser(description="Typing Master")
+    parser.add_argument("--debug", action="store_true",
+                        help="run TensorFlow functions eagerly and enable tf.data debug mode")
+    parser.add_argument("--corpus", default="typing_corpus.txt",
+                        help="text file with one practice passage per line (default: %(default)s)")
+    parser.add_argument("--check-model", action="store_true",
+                        help="compare NumPy and Keras predictions of the difficulty model and exit")
+    parser.add_argument("--check-index", action="store_true",
+                        help="compare the saved stats index with the session log and exit")
+    parser.add_argument("--benchmark", action="store_true",
+                        help="replay synthetic typing sessions headlessly, report latencies and exit")
+    parser.add_argument("--wpm", type=float, default=60,
+                        help="typing speed of the simulated typist (default: %(default)s)")
+    parser.add_argument("--error-rate", type=float, default=0.03,
+                        help="fraction of characters the simulated typist mistypes and corrects (default: %(default)s)")
+    parser.add_argument("--backspace-rate", type=float, default=0.01,
+                        help="fraction of correct characters the simulated typist deletes and retypes (default: %(default)s)")
+    parser.add_argument("--serve", action="store_true",
+                        help="run the multi-user typing server instead of the window")
+    parser.add_argument("--load-test", type=int, metavar="USERS",
+                        help="run USERS simulated typists against a running server and exit")
+    parser.add_argument("--host", default="127.0.0.1", help="server address (default: %(default)s)")
+    parser.add_argument("--port", type=int, default=8765, help="server port (default: %(default)s)")
+    parser.add_argument("--data-dir", default=TypingServer.DATA_DIR,
+                        help="directory for per-user session logs in server mode (default: %(default)s)")
+    parser.add_argument("--batch-size", type=int, default=64,
+                        help="most difficulty predictions run in one forward pass (default: %(default)s)")
+    parser.add_argument("--batch-delay", type=float, default=5,
+                        help="milliseconds a prediction may wait for its batch to fill (default: %(default)s)")
+    parser.add_argument("--model-cache", type=int, default=256,
+                        help="per-user models, profiles and session stores kept in memory in server mode (default: %(default)s)")
+    parser.add_argument("--user", help="practice under a personal profile with its own history and model")
+    args = parser.parse_args()
+    if args.user is not None and not TypingServer.USER_PATTERN.fullmatch(args.user):
+        parser.error(f"invalid user name: {args.user!r}")
+    
+    if args.load_test:
+        ok = run_load_test(args.host, args.port, args.load_test, wpm=args.wpm,
+                           error_rate=args.error_rate, backspace_rate=args.backspace_rate)
+        raise SystemExit(0 if ok else 1)
+    
+    if args.serve:
+        corpus = CorpusIndex(TypeSpeedGUI.TEXT_SAMPLES, external=MainPage.load_corpus(args.corpus))
+        model_service = ModelService('typing_model.keras', None, debug=args.debug,
+                                     max_batch=args.batch_size, max_delay=args.batch_delay / 1000)
+        server = TypingServer(corpus, args.data_dir, model_service, args.model_cache)
+        try:
+            asyncio.run(server.serve(args.host, args.port))
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.shutdown()
+        raise SystemExit(0)
+    
+    if args.benchmark:
+        benchmark_accuracy_tracking()
+        print()
+        benchmark_sessions(args.wpm, args.error_rate, args.backspace_rate)
+        raise SystemExit(0)
+    
+    if args.check_index:
+        if args.user is None:
+            log_path, index_path = 'typing_sessions.jsonl', 'typing_stats_index.json'
+        else:
+            log_path, index_path = (os.path.join(TypingServer.DATA_DIR, args.user) + suffix
+                                    for suffix in (".jsonl", ".index.json"))
+        # Opening the store normally would quietly rebuild a stale index
+        mismatches = SessionStore(log_path, index_path, load=False).check_index()
+        for mismatch in mismatches:
+            print(mismatch)
+        print(f"Stats index {'matches' if not mismatches else 'does not match'} {log_path}")
+        raise SystemExit(1 if mismatches else 0)
+    
+    if args.check_model:
+        # No session store: checking the model shouldn't migrate or rewrite the history
+        try:
+            max_error = ModelService('typing_model.keras', None, debug=args.debug).check_parity()
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Cannot check typing_model.keras: {e}")
+            raise SystemExit(1)
+        print(f"Max difference between NumPy and Keras predictions: {max_error:.2e}")
+        raise SystemExit(0 if max_error < 1e-3 else 1)
+    
+    startup_begin = time.perf_counter()
+    app = MainPage(debug=args.debug, corpus_path=args.corpus, user=args.user)
+    app.update()  # Let the window map and paint before measuring
+    print(f"Startup time: {time.perf_counter() - startup_begin:.3f}s")
     app.mainloop()
\ No newline at end of file